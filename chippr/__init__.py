@@ -13,5 +13,6 @@ from mvn import *
 from multi_dist import *
 from catalog import *
 
+from inf_utils import *
 from log_z_dens import *
 from log_z_dens_plots import *
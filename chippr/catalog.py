@@ -12,6 +12,7 @@ import chippr
 from chippr import defaults as d
 from chippr import utils as u
 from chippr import sim_utils as su
+from chippr import inf_utils as iu
 from chippr import gauss
 from chippr import discrete
 from chippr import multi_dist
@@ -112,7 +113,7 @@ class catalog(object):
         # coarse /= np.sum(coarse, axis=1)[:, np.newaxis]  * self.dz_coarse
         return coarse
 
-    def create(self, truth, int_pr, N=d.n_gals, vb=True):
+    def create(self, truth, int_pr, N=d.n_gals, n_table=None, n_procs=1, seed=None, chunk_size=d.cat_chunk_size, vb=True):
         """
         Function creating a catalog of interim posterior probability
         distributions, will split this up into helper functions
@@ -125,6 +126,22 @@ class catalog(object):
         int_pr: chippr.gmix object or chippr.gauss object or chippr.discrete
         object
             interim prior distribution object
+        N: int, optional
+            log10 number of galaxies
+        n_table: int, optional
+            number of observed redshifts at which to tabulate the likelihoods
+            for lookup, defaults to evaluating them for every galaxy
+        n_procs: int, optional
+            number of worker processes over which to create chunks of
+            galaxies, defaults to creating the whole catalog at once in the
+            calling process
+        seed: int, optional
+            root seed from which each chunk's random stream is derived, so the
+            catalog is identical for any n_procs; defaults to drawing from the
+            global random state when n_procs is 1 and to chippr.defaults.seed
+            otherwise
+        chunk_size: int, optional
+            number of galaxies per chunk when n_procs or seed is given
         vb: boolean, optional
             True to print progress messages to stdout, False to suppress
 
@@ -133,8 +150,70 @@ class catalog(object):
         self.cat: dict
             dictionary comprising catalog information
         """
+        if n_procs > 1 or seed is not None:
+            chunks = list(self.create_chunks(truth, int_pr, N=N, chunk_size=chunk_size, n_table=n_table, n_procs=n_procs, seed=seed, vb=vb))
+            self.samps = np.concatenate([chunk[0] for chunk in chunks])
+            self.cat['true_vals'] = self.samps
+            if vb:
+                plots.plot_true_histogram(self.samps.T[0], n_bins=(self.n_coarse, self.n_tot), plot_loc=self.plot_dir, prepend=self.cat_name)
+            self.cat['bin_ends'] = self.bin_ends
+            self.cat['log_interim_prior'] = self.log_int_pr_coarse
+            self.cat['log_interim_posteriors'] = np.concatenate([chunk[1] for chunk in chunks])
+            return self.cat
+
         self.N = 10**N
-        self.N_range = range(self.N)
+
+        self.prepare(truth, int_pr, n_table=n_table, vb=vb)
+
+        ## next, sample discrete to get z_true, z_obs
+        self.samps = self.sample_pspace(self.N)
+        self.cat['true_vals'] = self.samps
+        if vb:
+            plots.plot_true_histogram(self.samps.T[0], n_bins=(self.n_coarse, self.n_tot), plot_loc=self.plot_dir, prepend=self.cat_name)
+
+        ## then literally take slices (evaluate at constant z_phot)
+        #self.obs_lfs /= np.sum(self.obs_lfs, axis=1)[:, np.newaxis] * self.dz_fine
+
+        if self.lf_table is None or vb:
+            self.obs_lfs = self.evaluate_lfs_vectorized(self.int_pr_fine, self.samps.T[1])
+
+        # truth_fine = self.truth.pdf(self.z_fine)
+        #
+        # pfs_fine = self.obs_lfs * int_pr_fine[np.newaxis, :] / truth_fine[np.newaxis, :]
+        if self.lf_table is None:
+            pfs_coarse = self.coarsify(self.obs_lfs)
+        else:
+            pfs_coarse = self.look_up_lfs(self.samps.T[1])
+
+        if vb:
+            # plots.plot_scatter(self.samps, self.obs_lfs, self.z_fine, plot_loc=self.plot_dir, prepend=self.cat_name)
+            plots.plot_mega_scatter(self.samps, self.obs_lfs, self.z_fine, self.bin_ends, truth=[self.z_fine, self.hor_amps], plot_loc=self.plot_dir, prepend=self.cat_name, int_pr=[self.z_fine, self.int_pr_fine])
+
+        self.cat['bin_ends'] = self.bin_ends
+        self.cat['log_interim_prior'] = self.log_int_pr_coarse
+        self.cat['log_interim_posteriors'] = u.safe_log(pfs_coarse)
+
+        return self.cat
+
+    def prepare(self, truth, int_pr, n_table=None, vb=True):
+        """
+        Function setting up the probability spaces from which galaxies are
+        drawn and in which their likelihoods are evaluated
+
+        Parameters
+        ----------
+        truth: chippr.gmix object or chippr.gauss object or chippr.discrete
+        object
+            true redshift distribution object
+        int_pr: chippr.gmix object or chippr.gauss object or chippr.discrete
+        object
+            interim prior distribution object
+        n_table: int, optional
+            number of observed redshifts at which to tabulate the likelihoods
+            for lookup, defaults to evaluating them for every galaxy
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+        """
         self.truth = truth
 
         self.proc_bins()
@@ -143,8 +222,9 @@ class catalog(object):
         # samps_prep[0] = self.truth.sample(self.N)
 
         prob_components = self.make_probs()
-        hor_amps = self.truth.evaluate(self.z_fine) * self.bin_difs_fine
-        self.pspace_draw = gmix(hor_amps, prob_components)
+        self.hor_amps = self.truth.evaluate(self.z_fine) * self.bin_difs_fine
+        self.pspace_draw = gmix(self.hor_amps, prob_components)
+        (self.draw_probs, self.draw_aliases) = su.make_alias(self.hor_amps)
         if vb:
             plots.plot_prob_space(self.z_fine, self.pspace_draw, plot_loc=self.plot_dir, prepend=self.cat_name+'draw_')
 
@@ -152,43 +232,171 @@ class catalog(object):
         # if vb:
         #     plots.plot_prob_space(self.z_fine, self.prob_space, plot_loc=self.plot_dir, prepend=self.cat_name)
 
-        ## next, sample discrete to get z_true, z_obs
-        self.samps = self.pspace_draw.sample(self.N)
-        self.cat['true_vals'] = self.samps
-        if vb:
-            plots.plot_true_histogram(self.samps.T[0], n_bins=(self.n_coarse, self.n_tot), plot_loc=self.plot_dir, prepend=self.cat_name)
-
-        ## then literally take slices (evaluate at constant z_phot)
-        #self.obs_lfs /= np.sum(self.obs_lfs, axis=1)[:, np.newaxis] * self.dz_fine
-
         self.int_pr = int_pr
         int_pr_fine = self.int_pr.pdf(self.z_fine)
-        int_pr_fine = int_pr_fine / np.dot(int_pr_fine, self.bin_difs_fine)
-        self.pspace_eval = gmix(int_pr_fine, prob_components)
+        self.int_pr_fine = int_pr_fine / np.dot(int_pr_fine, self.bin_difs_fine)
+        self.pspace_eval = gmix(self.int_pr_fine, prob_components)
         if vb:
             plots.plot_prob_space(self.z_fine, self.pspace_eval, plot_loc=self.plot_dir, prepend=self.cat_name+'eval_')
 
-        self.obs_lfs = self.evaluate_lfs(self.pspace_eval)
-
-        # truth_fine = self.truth.pdf(self.z_fine)
-        #
-        # pfs_fine = self.obs_lfs * int_pr_fine[np.newaxis, :] / truth_fine[np.newaxis, :]
-        pfs_coarse = self.coarsify(self.obs_lfs)
         if vb:
-            print('before coarsify: '+str(int_pr_fine))
-        int_pr_coarse = self.coarsify(np.array([int_pr_fine]))[0]
+            print('before coarsify: '+str(self.int_pr_fine))
+        int_pr_coarse = self.coarsify(np.array([self.int_pr_fine]))[0]
         if vb:
             print('after coarsify: '+str(int_pr_coarse))
+        norm_int_pr_coarse = int_pr_coarse / (np.sum(int_pr_coarse) * self.dz_coarse)
+        self.log_int_pr_coarse = u.safe_log(norm_int_pr_coarse)
 
-        if vb:
-            # plots.plot_scatter(self.samps, self.obs_lfs, self.z_fine, plot_loc=self.plot_dir, prepend=self.cat_name)
-            plots.plot_mega_scatter(self.samps, self.obs_lfs, self.z_fine, self.bin_ends, truth=[self.z_fine, hor_amps], plot_loc=self.plot_dir, prepend=self.cat_name, int_pr=[self.z_fine, int_pr_fine])
+        if n_table is None:
+            self.lf_table = None
+        else:
+            self.make_lf_table(self.int_pr_fine, n_table=n_table, vb=vb)
+        return
 
-        norm_int_pr_coarse = int_pr_coarse / (np.sum(int_pr_coarse) * self.dz_coarse)
-        self.cat['bin_ends'] = self.bin_ends
-        self.cat['log_interim_prior'] = u.safe_log(norm_int_pr_coarse)
-        self.cat['log_interim_posteriors'] = u.safe_log(pfs_coarse)
+    def make_chunk(self, start, chunk_size=d.cat_chunk_size, seed=None):
+        """
+        Function creating the interim posteriors of one chunk of galaxies,
+        after catalog.prepare
+
+        Parameters
+        ----------
+        start: int
+            index of the first galaxy in the chunk
+        chunk_size: int, optional
+            number of galaxies per chunk
+        seed: int, optional
+            root seed from which to derive the chunk's own random state,
+            defaults to drawing from the global random state
+
+        Returns
+        -------
+        samps: numpy.ndarray, float
+            (z_true, z_obs) pairs of the galaxies in the chunk
+        log_pfs: numpy.ndarray, float
+            logged coarse interim posteriors of the galaxies in the chunk
+        """
+        if seed is None:
+            random_state = np.random
+        else:
+            random_state = np.random.RandomState(su.chunk_seed(seed, start // chunk_size))
+        n_chunk = min(chunk_size, self.N - start)
+        samps = self.sample_pspace(n_chunk, random_state=random_state)
+        if self.lf_table is None:
+            pfs = self.coarsify(self.evaluate_lfs_vectorized(self.int_pr_fine, samps.T[1]))
+        else:
+            pfs = self.look_up_lfs(samps.T[1])
+        log_pfs = u.safe_log(pfs)
+        return (samps, log_pfs)
+
+    def create_chunks(self, truth, int_pr, N=d.n_gals, chunk_size=d.cat_chunk_size, n_table=None, n_procs=1, seed=None, vb=True):
+        """
+        Generator creating a catalog of interim posterior probability
+        distributions a fixed number of galaxies at a time, so that only one
+        chunk of fine-grid likelihoods is ever held in memory per worker
+
+        Parameters
+        ----------
+        truth: chippr.gmix object or chippr.gauss object or chippr.discrete
+        object
+            true redshift distribution object
+        int_pr: chippr.gmix object or chippr.gauss object or chippr.discrete
+        object
+            interim prior distribution object
+        N: int, optional
+            log10 number of galaxies
+        chunk_size: int, optional
+            number of galaxies per chunk
+        n_table: int, optional
+            number of observed redshifts at which to tabulate the likelihoods
+            once for all chunks, defaults to evaluating them for every galaxy
+        n_procs: int, optional
+            number of worker processes to fork once for all chunks, each
+            creating one chunk at a time
+        seed: int, optional
+            root seed from which each chunk's random stream is derived, so the
+            chunks are identical for any n_procs; defaults to drawing from the
+            global random state when n_procs is 1 and to chippr.defaults.seed
+            otherwise
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+
+        Returns
+        -------
+        samps: numpy.ndarray, float
+            (z_true, z_obs) pairs of the galaxies in each chunk
+        log_pfs: numpy.ndarray, float
+            logged coarse interim posteriors of the galaxies in each chunk
+        """
+        self.N = 10**N
+        self.prepare(truth, int_pr, n_table=n_table, vb=vb)
+        if n_procs > 1 and seed is None:
+            seed = d.seed
+
+        def make_one(start):
+            return self.make_chunk(start, chunk_size=chunk_size, seed=seed)
+
+        starts = range(0, self.N, chunk_size)
+        for start, chunk in zip(starts, iu.parallel_imap(make_one, starts, n_procs=n_procs)):
+            if vb:
+                print('created galaxies '+str(start)+' through '+str(start + len(chunk[0]) - 1))
+            yield chunk
+
+    def stream(self, truth, int_pr, N=d.n_gals, chunk_size=d.cat_chunk_size, n_table=None, n_procs=1, seed=None, loc='data', vb=True):
+        """
+        Function creating a catalog chunk by chunk, writing each chunk to
+        numpy binary files before creating the next, in the format read by
+        catalog.read with style '.npy'
+
+        Parameters
+        ----------
+        truth: chippr.gmix object or chippr.gauss object or chippr.discrete
+        object
+            true redshift distribution object
+        int_pr: chippr.gmix object or chippr.gauss object or chippr.discrete
+        object
+            interim prior distribution object
+        N: int, optional
+            log10 number of galaxies
+        chunk_size: int, optional
+            number of galaxies per chunk
+        n_table: int, optional
+            number of observed redshifts at which to tabulate the likelihoods
+            once for all chunks, defaults to evaluating them for every galaxy
+        n_procs: int, optional
+            number of worker processes to fork, each creating one chunk at a
+            time
+        seed: int, optional
+            root seed from which each chunk's random stream is derived, so the
+            catalog is identical for any n_procs
+        loc: string, optional
+            file name into which to save catalog
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
 
+        Returns
+        -------
+        self.cat: dict
+            dictionary comprising catalog information, with memory-mapped
+            interim posteriors and true values
+        """
+        style = '.npy'
+        chunks = self.create_chunks(truth, int_pr, N=N, chunk_size=chunk_size, n_table=n_table, n_procs=n_procs, seed=seed, vb=vb)
+        output = None
+        start = 0
+        for (samps, log_pfs) in chunks:
+            if output is None:
+                np.save(os.path.join(self.data_dir, 'meta'+loc + style), self.bin_ends)
+                output = np.lib.format.open_memmap(os.path.join(self.data_dir, loc + style), mode='w+', shape=(self.N + 1, self.n_coarse))
+                output[0] = self.log_int_pr_coarse
+                true_vals = np.lib.format.open_memmap(os.path.join(self.data_dir, 'true_vals' + style), mode='w+', shape=(self.N, 2))
+            output[start + 1:start + 1 + len(samps)] = log_pfs
+            true_vals[start:start + len(samps)] = samps
+            start += len(samps)
+        output.flush()
+        true_vals.flush()
+        del output, true_vals
+        self.read(loc=loc, style=style)
+        self.cat['true_vals'] = np.load(os.path.join(self.data_dir, 'true_vals' + style), mmap_mode='r')
         return self.cat
 
     def make_probs(self, vb=True):
@@ -219,6 +427,11 @@ class catalog(object):
 
         vert_funcs = [gauss(x_alt[kk], sigmas[kk]) for kk in range(self.n_tot)]
 
+        # component parameters for vectorized evaluation, noting that gauss takes a variance
+        self.lf_means = x_alt
+        self.lf_sigmas = np.sqrt(sigmas)
+        self.lf_outlier_fracs = np.zeros(self.n_tot)
+
         # grid_amps = self.truth.evaluate(x_vals)
         #
         # grid_means, grid_amps, uniform_lfs = self._setup_prob_space(true_func)
@@ -229,6 +442,7 @@ class catalog(object):
         if self.params['catastrophic_outliers'] != '0':
             frac = self.params['outlier_fraction']
             rel_fracs = np.array([frac, 1. - frac])
+            self.lf_outlier_fracs = frac * np.ones(self.n_tot)
             uniform_lf = discrete(np.array([self.bin_ends[0], self.bin_ends[-1]]), np.array([1.]))
             if self.params['catastrophic_outliers'] == 'uniform':
                 # use_frac = np.max((0., frac-0.01))
@@ -248,6 +462,7 @@ class catalog(object):
                     # items = np.array([vert_funcs[kk].pdf(self.z_fine[kk]) for kk in range(self.n_tot)])
                     fracs = np.array([full_pdf, np.ones(self.n_tot)]).T
                     fracs = fracs * np.array([frac, 1.-frac])[np.newaxis, :]
+                    self.lf_outlier_fracs = fracs[:, 0] / np.sum(fracs, axis=1)
                     grid_funcs = [gmix(fracs[kk], [uniform_lf, vert_funcs[kk]], limits=(self.bin_ends[0], self.bin_ends[-1])) for kk in range(self.n_tot)]
                     # out_funcs = [multi_dist([uniform_lfs[kk], uniform_lf]) for kk in range(self.n_tot)]
                     # out_amps = self.outlier_lf.pdf(grid_means)
@@ -270,6 +485,46 @@ class catalog(object):
 
         return p_space
 
+    def sample_pspace(self, n_samps, random_state=np.random):
+        """
+        Function drawing (z_true, z_obs) pairs from the mixture in
+        catalog.pspace_draw with bulk array operations, after catalog.prepare
+
+        Parameters
+        ----------
+        n_samps: int
+            number of pairs to draw
+        random_state: numpy.random.RandomState object, optional
+            source of random numbers, defaults to the global random state
+
+        Returns
+        -------
+        samps: numpy.ndarray, float
+            (n_samps, 2) array of true and observed redshifts
+
+        Notes
+        -----
+        Draws a fine bin with probability catalog.hor_amps from its alias
+        table, z_true uniformly within it, and z_obs from the bin's Gaussian
+        likelihood or, with the bin's outlier fraction, from the outlier
+        population.
+        """
+        comps = su.alias_choice(self.draw_probs, self.draw_aliases, n_samps, random_state=random_state)
+
+        z_true = self.z_min + (comps + random_state.random_sample(n_samps)) * self.dz_fine
+
+        z_obs = self.lf_means[comps] + self.lf_sigmas[comps] * random_state.normal(size=n_samps)
+        if self.params['catastrophic_outliers'] != '0':
+            outliers = random_state.random_sample(n_samps) < self.lf_outlier_fracs[comps]
+            n_out = np.sum(outliers)
+            if self.params['catastrophic_outliers'] == 'template':
+                z_obs[outliers] = self.params['outlier_mean'] + self.params['outlier_sigma'] * random_state.normal(size=n_out)
+            else:
+                z_obs[outliers] = random_state.uniform(self.bin_ends[0], self.bin_ends[-1], size=n_out)
+
+        samps = np.array([z_true, z_obs]).T
+        return samps
+
     # def _setup_prob_space(self):
     #     """
     #     Helper function for make_probs
@@ -425,14 +680,190 @@ class catalog(object):
             binning
         """
         lfs = []
-        for n in self.N_range:
-            points = zip(self.z_fine, [self.samps[n][1]] * self.n_tot)
+        for samp in self.samps:
+            points = zip(self.z_fine, [samp[1]] * self.n_tot)
             cur=pspace.pdf(np.array(points))
             lfs.append(cur)
         lfs = np.array(lfs)
         lfs /= np.sum(lfs, axis=-1)[:, np.newaxis] * self.dz_fine
         return lfs
 
+    def evaluate_inlier_lfs(self, z_obs):
+        """
+        Evaluates the Gaussian component of every fine bin built by make_probs
+        at observed redshifts
+
+        Parameters
+        ----------
+        z_obs: numpy.ndarray, float
+            observed redshifts of the galaxies
+
+        Returns
+        -------
+        inlier_lfs: numpy.ndarray, float
+            (N, n_fine) unnormalized Gaussian likelihoods
+        """
+        z_obs = np.asarray(z_obs, dtype=float)[:, np.newaxis]
+        inlier_lfs = np.exp(-0.5 * ((z_obs - self.lf_means[np.newaxis, :]) / self.lf_sigmas[np.newaxis, :]) ** 2)
+        inlier_lfs /= np.sqrt(2. * np.pi) * self.lf_sigmas[np.newaxis, :]
+        return inlier_lfs
+
+    def evaluate_outlier_lfs(self, z_obs):
+        """
+        Evaluates the catastrophic outlier component built by make_probs, which
+        is shared by all fine bins, at observed redshifts
+
+        Parameters
+        ----------
+        z_obs: numpy.ndarray, float
+            observed redshifts of the galaxies
+
+        Returns
+        -------
+        outlier_lfs: numpy.ndarray, float
+            (N, 1) outlier likelihoods, zero without outliers
+        """
+        z_obs = np.asarray(z_obs, dtype=float)[:, np.newaxis]
+        if self.params['catastrophic_outliers'] == 'template':
+            outlier_sigma = self.params['outlier_sigma']
+            outlier_lfs = np.exp(-0.5 * ((z_obs - self.params['outlier_mean']) / outlier_sigma) ** 2) / (np.sqrt(2. * np.pi) * outlier_sigma)
+        elif self.params['catastrophic_outliers'] != '0':
+            in_range = (z_obs >= self.bin_ends[0]) & (z_obs <= self.bin_ends[-1])
+            outlier_lfs = in_range / (self.bin_ends[-1] - self.bin_ends[0])
+        else:
+            outlier_lfs = np.zeros_like(z_obs)
+        return outlier_lfs
+
+    def combine_lfs(self, amps, inlier_lfs, outlier_lfs):
+        """
+        Mixes the components of the likelihoods and normalizes them over the
+        fine bins
+
+        Parameters
+        ----------
+        amps: numpy.ndarray, float
+            relative weights of the fine bins in the probability space
+        inlier_lfs: numpy.ndarray, float
+            (N, n_fine) Gaussian likelihoods
+        outlier_lfs: numpy.ndarray, float
+            (N, 1) outlier likelihoods
+
+        Returns
+        -------
+        lfs: numpy.ndarray, float
+            (N, n_fine) normalized likelihoods
+        """
+        lfs = inlier_lfs * (1. - self.lf_outlier_fracs[np.newaxis, :])
+        lfs += self.lf_outlier_fracs[np.newaxis, :] * outlier_lfs
+        lfs *= amps[np.newaxis, :]
+        lfs /= np.sum(lfs, axis=-1)[:, np.newaxis] * self.dz_fine
+        return lfs
+
+    def evaluate_lfs_vectorized(self, amps, z_obs, vb=True):
+        """
+        Evaluates likelihoods based on observed sample values in one broadcast
+        over galaxies and fine bins, from the components built by make_probs
+
+        Parameters
+        ----------
+        amps: numpy.ndarray, float
+            relative weights of the fine bins in the probability space
+        z_obs: numpy.ndarray, float
+            observed redshifts of the galaxies
+        vb: boolean
+            print progress to stdout?
+
+        Returns
+        -------
+        lfs: numpy.ndarray, float
+            array of likelihood values for each item as a function of fine
+            binning, equal to that of evaluate_lfs for the same probability
+            space
+        """
+        lfs = self.combine_lfs(amps, self.evaluate_inlier_lfs(z_obs), self.evaluate_outlier_lfs(z_obs))
+        return lfs
+
+    def make_lf_table(self, amps, n_table=d.n_lf_table, nearest=False, vb=True):
+        """
+        Tabulates the mixed, normalized and coarsified likelihoods once on a
+        regular grid of observed redshifts, for lookup by look_up_lfs
+
+        Parameters
+        ----------
+        amps: numpy.ndarray, float
+            relative weights of the fine bins in the probability space
+        n_table: int, optional
+            number of grid points spanning the observed redshifts, trading
+            accuracy for the cost of building the table
+        nearest: boolean, optional
+            True to take the nearest row of the table, False to interpolate
+            linearly between neighboring rows
+        vb: boolean
+            print progress to stdout?
+
+        Notes
+        -----
+        The grid spans the bin range when the outliers are uniform over it,
+        so that their discontinuities fall on the ends of the table, and the
+        inlier and template Gaussians out to d.lf_table_n_sigma standard
+        deviations otherwise.  The largest absolute error of the coarse
+        likelihoods halfway between grid points is kept as
+        self.lf_table_error.
+        """
+        self.lf_table_amps = amps
+        self.lf_table_nearest = nearest
+        if self.params['catastrophic_outliers'] in ['uniform', 'training']:
+            z_lo, z_hi = self.bin_ends[0], self.bin_ends[-1]
+        else:
+            z_lo = np.min(self.lf_means - d.lf_table_n_sigma * self.lf_sigmas)
+            z_hi = np.max(self.lf_means + d.lf_table_n_sigma * self.lf_sigmas)
+            if self.params['catastrophic_outliers'] == 'template':
+                out_width = d.lf_table_n_sigma * self.params['outlier_sigma']
+                z_lo = min(z_lo, self.params['outlier_mean'] - out_width)
+                z_hi = max(z_hi, self.params['outlier_mean'] + out_width)
+        n_table = max(n_table, 2)
+        self.lf_table_z = np.linspace(z_lo, z_hi, n_table)
+        self.lf_table = self.coarsify(self.evaluate_lfs_vectorized(amps, self.lf_table_z))
+
+        z_mids = 0.5 * (self.lf_table_z[:-1] + self.lf_table_z[1:])
+        # nudge midpoints off the rounding boundary so nearest lookup picks a neighbor deterministically
+        z_mids -= 1.e-9 * (self.lf_table_z[1] - self.lf_table_z[0])
+        exact = self.coarsify(self.evaluate_lfs_vectorized(amps, z_mids))
+        self.lf_table_error = np.max(np.abs(self.look_up_lfs(z_mids) - exact))
+        if vb:
+            print('likelihood table of '+str(n_table)+' rows has error up to '+str(self.lf_table_error))
+        return
+
+    def look_up_lfs(self, z_obs):
+        """
+        Produces coarse likelihoods based on observed sample values from the
+        table built by make_lf_table
+
+        Parameters
+        ----------
+        z_obs: numpy.ndarray, float
+            observed redshifts of the galaxies
+
+        Returns
+        -------
+        lfs: numpy.ndarray, float
+            array of likelihood values for each item as a function of coarse
+            binning, evaluated exactly for items beyond the table
+        """
+        z_obs = np.asarray(z_obs, dtype=float)
+        n_table = len(self.lf_table_z)
+        positions = (z_obs - self.lf_table_z[0]) / (self.lf_table_z[1] - self.lf_table_z[0])
+        if self.lf_table_nearest:
+            lfs = self.lf_table[np.clip(np.rint(positions).astype(int), 0, n_table - 1)]
+        else:
+            lower = np.clip(np.floor(positions).astype(int), 0, n_table - 2)
+            weights = (positions - lower)[:, np.newaxis]
+            lfs = (1. - weights) * self.lf_table[lower] + weights * self.lf_table[lower + 1]
+        outside = (z_obs < self.lf_table_z[0]) | (z_obs > self.lf_table_z[-1])
+        if np.any(outside):
+            lfs[outside] = self.coarsify(self.evaluate_lfs_vectorized(self.lf_table_amps, z_obs[outside]))
+        return lfs
+
     def write(self, loc='data', style='.txt'):
         """
         Function to write newly-created catalog to file
@@ -442,7 +873,8 @@ class catalog(object):
         loc: string, optional
             file name into which to save catalog
         style: string, optional
-            file format in which to save the catalog
+            file format in which to save the catalog, '.txt' for plaintext or
+            '.npy' for numpy binary files that can be memory-mapped on reading
         """
         if style == '.txt':
             np.savetxt(os.path.join(self.data_dir, 'meta'+loc + style), self.cat['bin_ends'])
@@ -460,6 +892,11 @@ class catalog(object):
             #     out = csv.writer(csvfile, delimiter=' ')
             #     for line in self.cat['true_vals']:
             #         out.writerow(line)
+        elif style == '.npy':
+            np.save(os.path.join(self.data_dir, 'meta'+loc + style), self.cat['bin_ends'])
+            output = np.vstack((self.cat['log_interim_prior'], self.cat['log_interim_posteriors']))
+            np.save(os.path.join(self.data_dir, loc + style), output)
+            np.save(os.path.join(self.data_dir, 'true_vals' + style), self.cat['true_vals'])
         return
 
     def read(self, loc='data', style='.txt'):
@@ -470,6 +907,10 @@ class catalog(object):
         ----------
         loc: string, optional
             location of catalog file
+        style: string, optional
+            file format of the catalog, '.txt' for plaintext or '.npy' for
+            numpy binary files, in which case the interim posteriors are
+            memory-mapped rather than read into memory
         """
         if style == '.txt':
             self.cat['bin_ends'] = np.loadtxt(os.path.join(self.data_dir, 'meta'+loc + style))
@@ -477,7 +918,12 @@ class catalog(object):
             # with open(os.path.join(self.data_dir, loc + style), 'rb') as csvfile:
             #     tuples = (line.split(None) for line in csvfile)
             #     alldata = [[float(pair[k]) for k in range(0, len(pair))] for pair in tuples]
-        # self.cat['bin_ends'] = np.array(alldata[0])
-        self.cat['log_interim_prior'] = np.array(alldata[0])
-        self.cat['log_interim_posteriors'] = np.array(alldata[1:])
+            # self.cat['bin_ends'] = np.array(alldata[0])
+            self.cat['log_interim_prior'] = np.array(alldata[0])
+            self.cat['log_interim_posteriors'] = np.array(alldata[1:])
+        elif style == '.npy':
+            self.cat['bin_ends'] = np.load(os.path.join(self.data_dir, 'meta'+loc + style))
+            alldata = np.load(os.path.join(self.data_dir, loc + style), mmap_mode='r')
+            self.cat['log_interim_prior'] = np.array(alldata[0])
+            self.cat['log_interim_posteriors'] = alldata[1:]
         return self.cat
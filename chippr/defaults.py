@@ -18,11 +18,47 @@ cat_out_sigma = 0.01
 constant_sigma = 0.03
 constant_bias = 0.003
 
+n_lf_table = 10**4
+lf_table_n_sigma = 5.
+cat_chunk_size = 10**4
+
 gr_threshold = 1.2
+acor_window = 5.
+acor_tol = 0.05
+checkpoint_chain_loc = 'chain.dat'
 
 n_accepted = 3
 n_burned = 2
 
+nuts_target_accept = 0.8
+nuts_max_depth = 10
+nuts_max_energy_error = 1000.
+nuts_gamma = 0.05
+nuts_t0 = 10.
+nuts_kappa = 0.75
+
+mmle_method = 'L-BFGS-B'
+mmle_max_evals = 10**5
+em_tol = 1.e-8
+n_mmle_draws = 4
+laplace_eig_tol = 1.e-8
+
+chunk_size = 10**4
+
+adam_learning_rate = 0.01
+vi_n_iterations = 1000
+vi_n_mc = 4
+vi_initial_scale = 0.1
+
+sg_batch_size = 100
+sg_n_iterations = 10**4
+sg_n_accepted = 4
+sg_n_burned = 3
+sgld_step_size = 1.e-3
+sghmc_step_size = 1.e-4
+sg_friction = 0.1
+sg_tol = 0.05
+
 plot_colors = 5
 dpi = 250
 
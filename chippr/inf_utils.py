@@ -0,0 +1,959 @@
+# Module containing generally handy functions used by inference module
+
+import numpy as np
+import os
+import cPickle as cpkl
+import multiprocessing as mp
+import emcee
+
+import chippr
+from chippr import defaults as d
+
+# function inherited by forked worker processes so that the catalog it closes
+# over is shared rather than pickled at every call
+_shared_batch_func = None
+
+def _evaluate_shared(positions):
+    """
+    Helper function evaluating the batched function shared with forked worker
+    processes
+
+    Parameters
+    ----------
+    positions: numpy.ndarray, float
+        (n_walkers, n_dims) positions of a subset of walkers
+
+    Returns
+    -------
+    log_probs: numpy.ndarray, float
+        log-probabilities of the subset of walkers
+    """
+    log_probs = _shared_batch_func(positions)
+    return log_probs
+
+class vectorized_pool(object):
+
+    def __init__(self, batch_func, n_procs=1, executor=None):
+        """
+        Stand-in for a multiprocessing pool that hands walker positions to a
+        batched log-probability function all at once, or split evenly over
+        workers
+
+        Parameters
+        ----------
+        batch_func: function
+            function taking an (n_walkers, n_bins) array of positions and
+            returning a vector of n_walkers log-probabilities
+        n_procs: int, optional
+            number of workers over which to split the walkers, which are
+            forked processes if no executor is given, defaults to evaluating
+            in the calling process
+        executor: object, optional
+            pool of workers with a map method, e.g. a
+            multiprocessing.pool.ThreadPool, to which batch_func is passed
+            directly; for worker processes, give only n_procs instead so the
+            catalog is inherited by the workers rather than pickled
+        """
+        global _shared_batch_func
+        self.batch_func = batch_func
+        self.own_executor = False
+        self.n_workers = n_procs
+        if executor is not None:
+            self.executor = executor
+            self.worker_func = batch_func
+        elif n_procs > 1:
+            _shared_batch_func = batch_func
+            self.executor = mp.Pool(n_procs)
+            self.own_executor = True
+            self.worker_func = _evaluate_shared
+        else:
+            self.executor = None
+
+    def evaluate(self, positions):
+        """
+        Function evaluating the batched function for all walkers
+
+        Parameters
+        ----------
+        positions: numpy.ndarray, float
+            (n_walkers, n_bins) positions of all walkers
+
+        Returns
+        -------
+        log_probs: numpy.ndarray, float
+            log-probabilities of all walkers
+        """
+        positions = np.asarray(positions)
+        if self.executor is None or self.n_workers <= 1:
+            log_probs = self.batch_func(positions)
+        else:
+            blocks = np.array_split(positions, min(self.n_workers, len(positions)))
+            log_probs = np.concatenate(list(self.executor.map(self.worker_func, blocks)))
+        return log_probs
+
+    def map(self, func, positions):
+        """
+        Function emulating the map method of a pool
+
+        Parameters
+        ----------
+        func: function
+            per-walker function passed by emcee, ignored in favor of the
+            batched function
+        positions: list, numpy.ndarray, float
+            positions of all walkers
+
+        Returns
+        -------
+        results: list, float
+            log-probabilities of all walkers
+        """
+        results = list(self.evaluate(np.array(positions)))
+        return results
+
+    def close(self):
+        """
+        Function shutting down worker processes forked by this object
+        """
+        if self.own_executor:
+            self.executor.close()
+            self.executor.join()
+            self.executor = None
+            self.own_executor = False
+        return
+
+def parallel_map(func, items, n_procs=1, executor=None):
+    """
+    Function applying a function to every item, over forked worker processes
+    that share the function rather than receiving it pickled
+
+    Parameters
+    ----------
+    func: function
+        function of one item
+    items: list
+        arguments to which to apply func
+    n_procs: int, optional
+        number of worker processes to fork if no executor is given, defaults
+        to working in the calling process
+    executor: object, optional
+        pool of workers with a map method, e.g. a
+        multiprocessing.pool.ThreadPool, to use instead
+
+    Returns
+    -------
+    results: list
+        func applied to each item, in order
+    """
+    global _shared_batch_func
+    if executor is not None:
+        results = list(executor.map(func, items))
+    elif n_procs > 1:
+        _shared_batch_func = func
+        pool = mp.Pool(min(n_procs, len(items)))
+        try:
+            results = pool.map(_evaluate_shared, items)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [func(item) for item in items]
+    return results
+
+def parallel_imap(func, items, n_procs=1):
+    """
+    Generator applying a function to every item in turn, over one set of
+    forked worker processes that share the function rather than receiving it
+    pickled and that work ahead of the caller
+
+    Parameters
+    ----------
+    func: function
+        function of one item
+    items: list
+        arguments to which to apply func
+    n_procs: int, optional
+        number of worker processes to fork, defaults to working in the calling
+        process
+
+    Returns
+    -------
+    result: object
+        func applied to each item, yielded in order
+    """
+    global _shared_batch_func
+    if n_procs > 1 and len(items) > 1:
+        _shared_batch_func = func
+        pool = mp.Pool(min(n_procs, len(items)))
+        try:
+            for result in pool.imap(_evaluate_shared, items):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for item in items:
+            yield func(item)
+
+def make_sampler(n_walkers, n_dims, batch_func, n_procs=1, executor=None):
+    """
+    Function setting up an emcee ensemble sampler that evaluates all walkers
+    in a single call to a batched log-probability function, optionally split
+    over workers
+
+    Parameters
+    ----------
+    n_walkers: int
+        number of walkers
+    n_dims: int
+        dimension of parameter space
+    batch_func: function
+        function taking an (n_walkers, n_dims) array of positions and
+        returning a vector of n_walkers log-probabilities
+    n_procs: int, optional
+        number of workers over which to split the walkers, see vectorized_pool
+    executor: object, optional
+        pool of workers with a map method, see vectorized_pool
+
+    Returns
+    -------
+    sampler: emcee.EnsembleSampler object
+        the ensemble sampler
+    evaluator: chippr.vectorized_pool object
+        the object evaluating the walkers, to be closed after sampling
+    """
+    evaluator = vectorized_pool(batch_func, n_procs=n_procs, executor=executor)
+    if int(emcee.__version__.split('.')[0]) >= 3:
+        sampler = emcee.EnsembleSampler(n_walkers, n_dims, evaluator.evaluate, vectorize=True)
+    else:
+        sampler = emcee.EnsembleSampler(n_walkers, n_dims, batch_func, pool=evaluator)
+    return (sampler, evaluator)
+
+def sample_steps(sampler, ivals, n_steps):
+    """
+    Generator advancing an emcee ensemble sampler without letting it store
+    the chain, so that the caller can write each step wherever it likes
+
+    Parameters
+    ----------
+    sampler: emcee.EnsembleSampler object
+        the ensemble sampler
+    ivals: numpy.ndarray, float
+        (n_walkers, n_dims) initial positions of the walkers
+    n_steps: int
+        number of steps to take
+
+    Returns
+    -------
+    pos: numpy.ndarray, float
+        (n_walkers, n_dims) positions of the walkers after each step
+    prob: numpy.ndarray, float
+        log-probabilities of the walkers after each step
+    """
+    if int(emcee.__version__.split('.')[0]) >= 3:
+        kwargs = {'store': False}
+    else:
+        kwargs = {'storechain': False}
+    for result in sampler.sample(ivals, iterations=n_steps, **kwargs):
+        (pos, prob) = tuple(result)[:2]
+        yield (pos, prob)
+
+class chain_buffer(object):
+
+    def __init__(self, n_walkers, n_dims, capacity=1, loc=None, n_steps=0):
+        """
+        Preallocated storage for MCMC chains that grows geometrically, kept in
+        memory or memory-mapped on disk
+
+        Parameters
+        ----------
+        n_walkers: int
+            number of walkers
+        n_dims: int
+            dimension of parameter space
+        capacity: int, optional
+            number of steps for which to allocate space initially
+        loc: string, optional
+            file in which to memory-map the chain, defaults to memory
+        n_steps: int, optional
+            number of steps already written to an existing file at loc, which
+            is then reopened rather than overwritten
+
+        Notes
+        -----
+        Steps are stored along the leading axis so that a memory-mapped file
+        can be extended without moving the steps already written.
+        """
+        self.n_walkers = n_walkers
+        self.n_dims = n_dims
+        self.loc = loc
+        self.n_steps = 0
+        self.capacity = 0
+        self.data = None
+        if n_steps > 0 and loc is not None:
+            step_size = n_walkers * n_dims * np.dtype(float).itemsize
+            self.capacity = os.path.getsize(loc) // step_size
+            self.data = np.memmap(loc, dtype=float, mode='r+', shape=(self.capacity, n_walkers, n_dims))
+            self.n_steps = n_steps
+            capacity = max(capacity, n_steps)
+        self.allocate(max(1, capacity))
+
+    def allocate(self, capacity):
+        """
+        Function to enlarge the storage, keeping the steps already written
+
+        Parameters
+        ----------
+        capacity: int
+            total number of steps for which to allocate space
+        """
+        if capacity <= self.capacity:
+            return
+        shape = (capacity, self.n_walkers, self.n_dims)
+        if self.loc is None:
+            data = np.empty(shape)
+            if self.data is not None:
+                data[:self.n_steps] = self.data[:self.n_steps]
+        else:
+            if self.data is None:
+                mode = 'w+'
+            else:
+                self.data.flush()
+                with open(self.loc, 'r+b') as chain_file:
+                    chain_file.truncate(np.prod(shape) * np.dtype(float).itemsize)
+                mode = 'r+'
+            data = np.memmap(self.loc, dtype=float, mode=mode, shape=shape)
+        self.data = data
+        self.capacity = capacity
+        return
+
+    def reserve(self, n_new):
+        """
+        Function to make room for additional steps, at least doubling the
+        storage whenever it must grow
+
+        Parameters
+        ----------
+        n_new: int
+            number of steps about to be written
+        """
+        if self.n_steps + n_new > self.capacity:
+            self.allocate(max(self.n_steps + n_new, 2 * self.capacity))
+        return
+
+    def append(self, positions):
+        """
+        Function to write the positions of all walkers at one step
+
+        Parameters
+        ----------
+        positions: numpy.ndarray, float
+            (n_walkers, n_dims) positions of the walkers
+        """
+        self.reserve(1)
+        self.data[self.n_steps] = positions
+        self.n_steps += 1
+        return
+
+    def extend(self, chains):
+        """
+        Function to write the positions of all walkers at several steps
+
+        Parameters
+        ----------
+        chains: numpy.ndarray, float
+            (n_walkers, n_new, n_dims) positions of the walkers
+        """
+        n_new = np.shape(chains)[1]
+        self.reserve(n_new)
+        self.data[self.n_steps:self.n_steps + n_new] = np.swapaxes(chains, 0, 1)
+        self.n_steps += n_new
+        return
+
+    def view(self, start=0, stop=None):
+        """
+        Function to access the steps written so far without copying them
+
+        Parameters
+        ----------
+        start: int, optional
+            first step to include, negative values counting from the end
+        stop: int, optional
+            step at which to stop, defaults to the last step written
+
+        Returns
+        -------
+        chains: numpy.ndarray, float
+            (n_walkers, n_steps, n_dims) view of the stored chain
+        """
+        chains = np.swapaxes(self.data[:self.n_steps][start:stop], 0, 1)
+        return chains
+
+    def flush(self):
+        """
+        Function to write any changes to a memory-mapped chain to disk
+        """
+        if self.loc is not None:
+            self.data.flush()
+        return
+
+class chain_store(object):
+
+    def __init__(self, loc, compress=False, mode='a'):
+        """
+        Append-only on-disk store of MCMC output, written one block of steps
+        at a time and read back lazily by step, walker and bin
+
+        Parameters
+        ----------
+        loc: string
+            directory holding one file per block and an index of the blocks
+        compress: boolean, optional
+            True to write compressed blocks, False to write blocks that can be
+            memory-mapped when read
+        mode: string, optional
+            'a' to append to any blocks already in the store, 'w' to discard
+            them, 'r' to read an existing store
+
+        Notes
+        -----
+        Every field of a block has walkers along the first axis and steps along
+        the second, like the chains returned by the sampler.
+        """
+        self.loc = loc
+        self.index_loc = os.path.join(self.loc, 'index.p')
+        if mode == 'r' and not os.path.exists(self.index_loc):
+            raise IOError('no chain store at '+self.loc)
+        if not os.path.exists(self.loc):
+            os.makedirs(self.loc)
+        if mode in ['a', 'r'] and os.path.exists(self.index_loc):
+            with open(self.index_loc, 'rb') as index_file:
+                self.index = cpkl.load(index_file)
+        else:
+            self.index = {'compress': compress, 'fields': None, 'lengths': []}
+            self.write_index()
+        self.compress = self.index['compress']
+
+    def write_index(self):
+        """
+        Function to replace the index of the blocks, via a temporary file so
+        that an interruption leaves the previous index intact
+        """
+        with open(self.index_loc + '.tmp', 'wb') as index_file:
+            cpkl.dump(self.index, index_file)
+        os.rename(self.index_loc + '.tmp', self.index_loc)
+        return
+
+    def block_loc(self, i, field=None):
+        """
+        Function to name the file holding a block
+
+        Parameters
+        ----------
+        i: int
+            number of the block
+        field: string, optional
+            name of the field, needed only for uncompressed blocks
+
+        Returns
+        -------
+        loc: string
+            path to the file
+        """
+        if self.compress:
+            loc = os.path.join(self.loc, 'block'+str(i)+'.npz')
+        else:
+            loc = os.path.join(self.loc, 'block'+str(i)+'_'+field+'.npy')
+        return loc
+
+    def append(self, block):
+        """
+        Function to add a block of steps to the store
+
+        Parameters
+        ----------
+        block: dict
+            arrays of the same number of steps for each field
+        """
+        fields = sorted(block.keys())
+        if self.index['fields'] is None:
+            self.index['fields'] = fields
+        elif fields != self.index['fields']:
+            raise ValueError('block has fields '+str(fields)+' but the store holds '+str(self.index['fields']))
+        i = len(self.index['lengths'])
+        if self.compress:
+            with open(self.block_loc(i) + '.tmp', 'wb') as block_file:
+                np.savez_compressed(block_file, **block)
+            os.rename(self.block_loc(i) + '.tmp', self.block_loc(i))
+        else:
+            for field in fields:
+                with open(self.block_loc(i, field) + '.tmp', 'wb') as block_file:
+                    np.save(block_file, np.asarray(block[field]))
+                os.rename(self.block_loc(i, field) + '.tmp', self.block_loc(i, field))
+        self.index['lengths'].append(np.shape(block[fields[0]])[1])
+        self.write_index()
+        return
+
+    def truncate(self, n_blocks):
+        """
+        Function to forget all but the first blocks, for example those written
+        after a checkpoint from which sampling resumes
+
+        Parameters
+        ----------
+        n_blocks: int
+            number of blocks to keep
+        """
+        self.index['lengths'] = self.index['lengths'][:n_blocks]
+        self.write_index()
+        return
+
+    def n_steps(self):
+        """
+        Function to count the steps in the store
+
+        Returns
+        -------
+        n_steps: int
+            total number of steps over all blocks
+        """
+        n_steps = sum(self.index['lengths'])
+        return n_steps
+
+    def read(self, field='chains', steps=None, walkers=None, bins=None):
+        """
+        Function to read part of a field, loading only the blocks that hold
+        the requested steps
+
+        Parameters
+        ----------
+        field: string, optional
+            name of the field
+        steps: slice or numpy.ndarray, int, optional
+            steps to read, counted over all blocks, defaults to all steps
+        walkers: slice or numpy.ndarray, int, optional
+            walkers to read, defaults to all walkers
+        bins: slice or numpy.ndarray, int, optional
+            bins to read from fields with a trailing parameter axis, defaults
+            to all bins
+
+        Returns
+        -------
+        values: numpy.ndarray, float
+            requested values with walkers along the first axis and steps along
+            the second, in the order requested
+        """
+        if not len(self.index['lengths']):
+            raise ValueError('chain store at '+self.loc+' holds no blocks')
+        if field not in self.index['fields']:
+            raise ValueError('chain store at '+self.loc+' holds fields '+str(self.index['fields'])+' but not '+field)
+        if walkers is None:
+            walkers = slice(None)
+        if bins is None:
+            bins = slice(None)
+        lengths = np.array(self.index['lengths'], dtype=int)
+        ends = np.cumsum(lengths)
+        wanted = np.arange(np.sum(lengths))
+        if steps is not None:
+            wanted = wanted[steps]
+        in_block = np.searchsorted(ends, wanted, side='right')
+        # blocks are read in turn, so parts come back grouped by block
+        order = np.argsort(in_block, kind='mergesort')
+        parts = []
+        for i in (np.unique(in_block) if len(wanted) else [0]):
+            local = wanted[in_block == i] - (ends[i] - lengths[i])
+            if self.compress:
+                with np.load(self.block_loc(i)) as block_file:
+                    values = block_file[field]
+            else:
+                values = np.load(self.block_loc(i, field), mmap_mode='r')
+            values = values[walkers][:, local]
+            if values.ndim > 2:
+                values = values[..., bins]
+            parts.append(np.array(values))
+        grouped = np.concatenate(parts, axis=1)
+        values = np.empty_like(grouped)
+        values[:, order] = grouped
+        return values
+
+def read_samples(meta, steps=None, walkers=None, bins=None):
+    """
+    Function to read part of the accepted samples of a sampler from the chain
+    store recorded in its meta data
+
+    Parameters
+    ----------
+    meta: dict
+        sampler meta data from log_z_dens, holding the location of the chain
+        store, the first accepted step and the shape of the accepted samples
+    steps: slice or numpy.ndarray, int, optional
+        accepted steps to read, defaults to all of them
+    walkers: slice or numpy.ndarray, int, optional
+        walkers to read, defaults to all walkers
+    bins: slice or numpy.ndarray, int, optional
+        bins to read, defaults to all bins
+
+    Returns
+    -------
+    samples: numpy.ndarray, float
+        requested logged redshift density function bin values with walkers
+        along the first axis and steps along the second
+    """
+    store = chain_store(meta['chain_loc'], mode='r')
+    accepted = np.arange(meta['chain_start'], meta['chain_start'] + meta['chain_shape'][1])
+    if steps is not None:
+        accepted = accepted[steps]
+    samples = store.read('chains', steps=accepted, walkers=walkers, bins=bins)
+    return samples
+
+class nuts_sampler(object):
+
+    def __init__(self, log_prob_and_gradient, n_dims, target_accept=d.nuts_target_accept, max_depth=d.nuts_max_depth, random_state=None):
+        """
+        No-U-Turn Sampler (Hoffman & Gelman 2014) with dual averaging of the
+        step size and a diagonal mass matrix adapted during warmup
+
+        Parameters
+        ----------
+        log_prob_and_gradient: function
+            function of a position returning the log-probability and its
+            gradient there
+        n_dims: int
+            dimension of parameter space
+        target_accept: float, optional
+            mean acceptance statistic sought by step size adaptation
+        max_depth: int, optional
+            maximum depth of the trajectory tree, allowing at most
+            2**max_depth - 1 leapfrog steps per sample
+        random_state: numpy.random.RandomState object, optional
+            source of random numbers, defaults to the global numpy state
+        """
+        self.log_prob_and_gradient = log_prob_and_gradient
+        self.n_dims = n_dims
+        self.target_accept = target_accept
+        self.max_depth = max_depth
+        if random_state is None:
+            random_state = np.random
+        self.random_state = random_state
+        self.inv_metric = np.ones(n_dims)
+        self.step_size = None
+
+    def leapfrog(self, state, direction, step_size):
+        """
+        Function to take one leapfrog step of Hamiltonian dynamics
+
+        Parameters
+        ----------
+        state: tuple
+            position, momentum, log-probability and gradient
+        direction: int
+            +1 to integrate forward in time, -1 to integrate backward
+        step_size: float
+            size of the step
+
+        Returns
+        -------
+        state: tuple
+            position, momentum, log-probability and gradient after the step
+        """
+        (x, r, log_prob, grad) = state
+        eps = direction * step_size
+        r = r + 0.5 * eps * grad
+        x = x + eps * self.inv_metric * r
+        (log_prob, grad) = self.log_prob_and_gradient(x)
+        r = r + 0.5 * eps * grad
+        state = (x, r, log_prob, grad)
+        return state
+
+    def hamiltonian(self, state):
+        """
+        Function to evaluate the negative total energy of a state
+
+        Parameters
+        ----------
+        state: tuple
+            position, momentum, log-probability and gradient
+
+        Returns
+        -------
+        joint: float
+            log-probability minus kinetic energy
+        """
+        joint = state[2] - 0.5 * np.dot(state[1], self.inv_metric * state[1])
+        if not np.isfinite(joint):
+            joint = -np.inf
+        return joint
+
+    def initial_step_size(self, state):
+        """
+        Function to find a step size whose single leapfrog step is accepted
+        with probability near one half
+
+        Parameters
+        ----------
+        state: tuple
+            position, log-probability and gradient, with momentum ignored
+
+        Returns
+        -------
+        step_size: float
+            heuristic initial step size
+        """
+        step_size = 1.
+        r = self.random_state.normal(size=self.n_dims) / np.sqrt(self.inv_metric)
+        state = (state[0], r, state[2], state[3])
+        joint = self.hamiltonian(state)
+        log_ratio = self.hamiltonian(self.leapfrog(state, 1, step_size)) - joint
+        direction = 2. * (log_ratio > np.log(0.5)) - 1.
+        for i in range(100):
+            if direction * log_ratio <= -direction * np.log(2.):
+                break
+            step_size *= 2. ** direction
+            log_ratio = self.hamiltonian(self.leapfrog(state, 1, step_size)) - joint
+        return step_size
+
+    def build_tree(self, state, log_u, direction, depth, step_size, joint_0):
+        """
+        Function to extend a trajectory by 2**depth leapfrog steps
+
+        Parameters
+        ----------
+        state: tuple
+            position, momentum, log-probability and gradient at the edge from
+            which to extend
+        log_u: float
+            log of the slice variable
+        direction: int
+            +1 to extend forward in time, -1 to extend backward
+        depth: int
+            depth of the subtree
+        step_size: float
+            leapfrog step size
+        joint_0: float
+            negative total energy at the start of the trajectory
+
+        Returns
+        -------
+        tree: dict
+            backward and forward edges, proposed state, number of states in
+            the slice, whether to continue, summed acceptance statistics,
+            number of leapfrog steps, and whether the trajectory diverged
+        """
+        if depth == 0:
+            new_state = self.leapfrog(state, direction, step_size)
+            joint = self.hamiltonian(new_state)
+            diverged = log_u - joint > d.nuts_max_energy_error
+            tree = {'minus': new_state, 'plus': new_state, 'proposal': new_state,
+                    'n_valid': int(log_u <= joint), 'go_on': not diverged,
+                    'sum_accept': min(1., np.exp(joint - joint_0)), 'n_steps': 1,
+                    'diverged': diverged}
+            return tree
+        tree = self.build_tree(state, log_u, direction, depth - 1, step_size, joint_0)
+        if not tree['go_on']:
+            return tree
+        if direction == -1:
+            subtree = self.build_tree(tree['minus'], log_u, direction, depth - 1, step_size, joint_0)
+            tree['minus'] = subtree['minus']
+        else:
+            subtree = self.build_tree(tree['plus'], log_u, direction, depth - 1, step_size, joint_0)
+            tree['plus'] = subtree['plus']
+        n_valid = tree['n_valid'] + subtree['n_valid']
+        if n_valid > 0 and self.random_state.uniform() < float(subtree['n_valid']) / n_valid:
+            tree['proposal'] = subtree['proposal']
+        tree['n_valid'] = n_valid
+        tree['go_on'] = subtree['go_on'] and self.no_u_turn(tree['minus'], tree['plus'])
+        tree['sum_accept'] += subtree['sum_accept']
+        tree['n_steps'] += subtree['n_steps']
+        tree['diverged'] = subtree['diverged']
+        return tree
+
+    def no_u_turn(self, minus, plus):
+        """
+        Function to check that a trajectory has not begun to double back
+
+        Parameters
+        ----------
+        minus: tuple
+            state at the backward edge of the trajectory
+        plus: tuple
+            state at the forward edge of the trajectory
+
+        Returns
+        -------
+        go_on: boolean
+            True if neither edge is moving toward the other
+        """
+        span = plus[0] - minus[0]
+        go_on = np.dot(span, self.inv_metric * minus[1]) >= 0. and np.dot(span, self.inv_metric * plus[1]) >= 0.
+        return go_on
+
+    def step(self, state, step_size):
+        """
+        Function to draw one sample by building a trajectory until it makes
+        a U-turn
+
+        Parameters
+        ----------
+        state: tuple
+            position, log-probability and gradient, with momentum ignored
+        step_size: float
+            leapfrog step size
+
+        Returns
+        -------
+        state: tuple
+            the next state of the chain
+        info: dict
+            mean acceptance statistic, number of leapfrog steps, tree depth,
+            and whether the trajectory diverged
+        """
+        r = self.random_state.normal(size=self.n_dims) / np.sqrt(self.inv_metric)
+        state = (state[0], r, state[2], state[3])
+        joint_0 = self.hamiltonian(state)
+        log_u = joint_0 - self.random_state.exponential()
+        minus = state
+        plus = state
+        proposal = state
+        n_valid = 1
+        sum_accept = 0.
+        n_steps = 0
+        diverged = False
+        for depth in range(self.max_depth):
+            direction = 2 * (self.random_state.uniform() < 0.5) - 1
+            if direction == -1:
+                tree = self.build_tree(minus, log_u, direction, depth, step_size, joint_0)
+                minus = tree['minus']
+            else:
+                tree = self.build_tree(plus, log_u, direction, depth, step_size, joint_0)
+                plus = tree['plus']
+            sum_accept += tree['sum_accept']
+            n_steps += tree['n_steps']
+            diverged = tree['diverged']
+            if not tree['go_on']:
+                break
+            if self.random_state.uniform() < float(tree['n_valid']) / n_valid:
+                proposal = tree['proposal']
+            n_valid += tree['n_valid']
+            if not self.no_u_turn(minus, plus):
+                break
+        info = {'accept_stat': sum_accept / n_steps, 'n_steps': n_steps,
+                'depth': depth + 1, 'diverged': diverged}
+        return (proposal, info)
+
+    def run(self, ivals, n_warmup, n_samps):
+        """
+        Function to adapt the sampler and then draw samples
+
+        Parameters
+        ----------
+        ivals: numpy.ndarray, float
+            initial position
+        n_warmup: int
+            number of adaptation steps, which are not returned
+        n_samps: int
+            number of samples to draw after adaptation
+
+        Returns
+        -------
+        outputs: dict
+            samples, their log-probabilities, and per-sample acceptance
+            statistics, leapfrog step counts, tree depths and divergences,
+            along with the adapted step size and inverse mass matrix
+
+        Notes
+        -----
+        The step size is tuned by dual averaging throughout warmup. The
+        inverse mass matrix is set to the regularized variance of the second
+        quarter of warmup, after which step size adaptation restarts.
+        """
+        (log_prob, grad) = self.log_prob_and_gradient(np.asarray(ivals, dtype=float))
+        state = (np.asarray(ivals, dtype=float), None, log_prob, grad)
+        metric_start = n_warmup // 4
+        metric_end = n_warmup // 2
+        warmup_positions = []
+        def _reset_adaptation(step_size):
+            return {'mu': np.log(10. * step_size), 'h_bar': 0., 'log_step_bar': 0., 't': 0}
+        step_size = self.initial_step_size(state)
+        adaptation = _reset_adaptation(step_size)
+        for i in range(n_warmup):
+            (state, info) = self.step(state, step_size)
+            adaptation['t'] += 1
+            t = adaptation['t']
+            eta = 1. / (t + d.nuts_t0)
+            adaptation['h_bar'] = (1. - eta) * adaptation['h_bar'] + eta * (self.target_accept - info['accept_stat'])
+            log_step = adaptation['mu'] - np.sqrt(t) / d.nuts_gamma * adaptation['h_bar']
+            weight = t ** -d.nuts_kappa
+            adaptation['log_step_bar'] = weight * log_step + (1. - weight) * adaptation['log_step_bar']
+            step_size = np.exp(log_step)
+            if metric_start <= i < metric_end:
+                warmup_positions.append(state[0])
+            if i == metric_end - 1 and len(warmup_positions) > 1:
+                n = len(warmup_positions)
+                variance = np.var(warmup_positions, axis=0, ddof=1)
+                self.inv_metric = n / (n + 5.) * variance + 1.e-3 * 5. / (n + 5.)
+                step_size = self.initial_step_size(state)
+                adaptation = _reset_adaptation(step_size)
+        if n_warmup > 0:
+            step_size = np.exp(adaptation['log_step_bar'])
+        self.step_size = step_size
+        outputs = {'samples': np.empty((n_samps, self.n_dims)), 'probs': np.empty(n_samps),
+                   'accept_stats': np.empty(n_samps), 'n_steps': np.empty(n_samps, dtype=int),
+                   'depths': np.empty(n_samps, dtype=int), 'divergences': np.zeros(n_samps, dtype=bool)}
+        for i in range(n_samps):
+            (state, info) = self.step(state, step_size)
+            outputs['samples'][i] = state[0]
+            outputs['probs'][i] = state[2]
+            outputs['accept_stats'][i] = info['accept_stat']
+            outputs['n_steps'][i] = info['n_steps']
+            outputs['depths'][i] = info['depth']
+            outputs['divergences'][i] = info['diverged']
+        outputs['step_size'] = step_size
+        outputs['inv_metric'] = self.inv_metric
+        return outputs
+
+class adam(object):
+
+    def __init__(self, learning_rate=d.adam_learning_rate, beta_1=0.9, beta_2=0.999, eps=1.e-8):
+        """
+        Adam stochastic gradient optimizer (Kingma & Ba 2015)
+
+        Parameters
+        ----------
+        learning_rate: float, optional
+            size of the steps
+        beta_1: float, optional
+            decay rate of the running mean of the gradient
+        beta_2: float, optional
+            decay rate of the running mean of the squared gradient
+        eps: float, optional
+            small number preventing division by zero
+        """
+        self.learning_rate = learning_rate
+        self.beta_1 = beta_1
+        self.beta_2 = beta_2
+        self.eps = eps
+        self.m = 0.
+        self.v = 0.
+        self.t = 0
+
+    def step(self, grad):
+        """
+        Function to calculate the next step down a stochastic gradient
+
+        Parameters
+        ----------
+        grad: numpy.ndarray, float
+            noisy estimate of the gradient of the function to minimize
+
+        Returns
+        -------
+        displacement: numpy.ndarray, float
+            change to make to the parameters
+        """
+        self.t += 1
+        self.m = self.beta_1 * self.m + (1. - self.beta_1) * grad
+        self.v = self.beta_2 * self.v + (1. - self.beta_2) * grad ** 2
+        m_hat = self.m / (1. - self.beta_1 ** self.t)
+        v_hat = self.v / (1. - self.beta_2 ** self.t)
+        displacement = -self.learning_rate * m_hat / (np.sqrt(v_hat) + self.eps)
+        return displacement
@@ -1,9 +1,10 @@
 import numpy as np
 import scipy as sp
 import os
+import timeit
 import scipy.optimize as op
 import cPickle as cpkl
-import emcee
+from multiprocessing.pool import ThreadPool
 
 import matplotlib as mpl
 mpl.use('PS')
@@ -14,11 +15,13 @@ from chippr import defaults as d
 from chippr import plot_utils as pu
 from chippr import utils as u
 from chippr import stat_utils as s
+from chippr import inf_utils as iu
+from chippr import sim_utils as su
 from chippr import log_z_dens_plots as plots
 
 class log_z_dens(object):
 
-    def __init__(self, catalog, hyperprior, truth=None, loc='.', prepend='', vb=True):
+    def __init__(self, catalog, hyperprior, truth=None, loc='.', prepend='', lean=False, chunk_size=d.chunk_size, n_threads=1, vb=True):
         """
         An object representing the redshift density function (normalized
         redshift distribution function)
@@ -27,7 +30,9 @@ class log_z_dens(object):
         ----------
         catalog: chippr.catalog object
             dict containing bin endpoints, interim prior bin values, and
-            interim posterior PDF bin values
+            interim posterior PDF bin values, the last of which may be a
+            memory-mapped array, the path to a .npy file, or a dict of the path
+            to a .npy file and the first row and shape of the posteriors in it
         hyperprior: chippr.mvn object
             multivariate Gaussian distribution for hyperprior distribution
         truth: chippr.gmix object, optional
@@ -37,6 +42,17 @@ class log_z_dens(object):
             directory into which to save results and plots made along the way
         prepend: str, optional
             prepend string to file names
+        lean: boolean, optional
+            True to keep only the logged interim posteriors of the catalog in
+            memory and work with them in chunks of galaxies, False to also
+            store the hyperlikelihood kernel; memory-mapped catalogs are
+            always treated as lean
+        chunk_size: int, optional
+            number of galaxies per chunk in lean mode, and per independent
+            random stream whatever the mode and number of threads
+        n_threads: int, optional
+            number of threads over which to split the catalog when summing
+            hyperlikelihood contributions, defaults to single-thread
         vb: boolean, optional
             True to print progress messages to stdout, False to suppress
         """
@@ -55,14 +71,49 @@ class log_z_dens(object):
         self.int_pr = np.exp(self.log_int_pr)
         self.info['log_interim_prior'] = self.log_int_pr
 
-        self.log_pdfs = np.array(catalog['log_interim_posteriors'])
-        self.pdfs = np.exp(self.log_pdfs)
+        log_pdfs = catalog['log_interim_posteriors']
+        if type(log_pdfs) == str:
+            log_pdfs = np.load(log_pdfs, mmap_mode='r')
+        elif type(log_pdfs) == dict:
+            start = log_pdfs['start']
+            log_pdfs = np.load(log_pdfs['loc'], mmap_mode='r')[start:start + log_pdfs['shape'][0]]
+        self.lean = lean or isinstance(log_pdfs, np.memmap)
+        if self.lean:
+            self.log_pdfs = np.asarray(log_pdfs)
+        else:
+            self.log_pdfs = np.array(log_pdfs)
         self.n_pdfs = len(self.log_pdfs)
-        self.info['log_interim_posteriors'] = self.log_pdfs
+        if isinstance(log_pdfs, np.memmap):
+            # only keep track of where the catalog lives to avoid pickling it
+            full = log_pdfs
+            while isinstance(full.base, np.memmap):
+                full = full.base
+            start = (np.byte_bounds(log_pdfs)[0] - np.byte_bounds(full)[0]) // log_pdfs.strides[0]
+            self.info['log_interim_posteriors'] = {'loc': log_pdfs.filename, 'start': start, 'shape': log_pdfs.shape}
+        else:
+            self.info['log_interim_posteriors'] = self.log_pdfs
 
         if vb:
             print(str(self.n_bins) + ' bins, ' + str(len(self.log_pdfs)) + ' interim posterior PDFs')
 
+        self.log_kernel_factor = self.log_bin_difs - self.log_int_pr
+        if self.lean:
+            self.kernel = None
+        else:
+            self.kernel = self.precompute()
+        # one shard of the catalog per thread, no larger than a chunk in lean mode
+        shard_size = max(1, int(np.ceil(float(self.n_pdfs) / n_threads)))
+        if self.lean:
+            shard_size = min(shard_size, chunk_size)
+        self.chunks = [slice(i, min(i + shard_size, self.n_pdfs)) for i in range(0, self.n_pdfs, shard_size)]
+        # random draws are made over fixed chunks so that they do not depend on n_threads
+        self.random_chunks = [slice(i, min(i + chunk_size, self.n_pdfs)) for i in range(0, self.n_pdfs, chunk_size)]
+        if n_threads > 1:
+            self.pool = ThreadPool(n_threads)
+            self.pool_pid = os.getpid()
+        else:
+            self.pool = None
+
         self.hyper_prior = hyperprior
 
         self.truth = truth
@@ -99,20 +150,111 @@ class log_z_dens(object):
             os.makedirs(self.res_dir)
 
         return
-    #
-    # def precompute(self):
-    #     """
-    #     Function to precompute values that show up in posterior that are independent of n(z) params
-    #
-    #     Returns
-    #     -------
-    #     precomputed: float
-    #         log-probability component independent of test params
-    #     """
-    #     integrated_int_pr = np.log(np.dot(self.int_pr, self.bin_difs))
-    #     integrated_int_posts = np.log(np.dot(self.pdfs, axis=0)
-    #     precomputed = integrated_int_posts - integrated_int_pr
-    #     return precomputed
+
+    def precompute(self):
+        """
+        Function to precompute values that show up in posterior that are
+        independent of n(z) params
+
+        Returns
+        -------
+        kernel: numpy.ndarray, float
+            (n_pdfs, n_bins) matrix of interim posteriors divided by the
+            interim prior and weighted by the bin widths, such that the
+            per-galaxy hyperlikelihoods are its product with normalized n(z)
+        """
+        kernel = np.exp(self.log_pdfs + self.log_kernel_factor[np.newaxis, :])
+        return kernel
+
+    def get_kernel(self, chunk):
+        """
+        Function to retrieve the hyperlikelihood kernel for a chunk of
+        galaxies, computing it from the logged interim posteriors in lean mode
+
+        Parameters
+        ----------
+        chunk: slice
+            range of galaxies in the catalog
+
+        Returns
+        -------
+        kernel: numpy.ndarray, float
+            (n_chunk, n_bins) kernel matrix, rescaled per galaxy in lean mode
+            so that its largest entry is unity
+        log_scales: numpy.ndarray or float
+            per-galaxy logged factors by which the kernel was rescaled, such
+            that the log hyperlikelihood of each galaxy is the log of its
+            product with normalized n(z) plus its log_scale
+        """
+        if self.lean:
+            log_kernel = self.log_pdfs[chunk] + self.log_kernel_factor[np.newaxis, :]
+            log_scales = np.max(log_kernel, axis=1)
+            log_kernel -= log_scales[:, np.newaxis]
+            kernel = np.exp(log_kernel, out=log_kernel)
+        else:
+            kernel = self.kernel[chunk]
+            log_scales = 0.
+        return (kernel, log_scales)
+
+    def get_pdfs(self, chunk):
+        """
+        Function to retrieve the interim posteriors for a chunk of galaxies,
+        recovering them from the hyperlikelihood kernel unless in lean mode
+
+        Parameters
+        ----------
+        chunk: slice
+            range of galaxies in the catalog
+
+        Returns
+        -------
+        pdfs: numpy.ndarray, float
+            (n_chunk, n_bins) interim posterior values
+        """
+        if self.lean:
+            pdfs = np.exp(self.log_pdfs[chunk])
+        else:
+            pdfs = self.kernel[chunk] * (self.int_pr / self.bin_difs)[np.newaxis, :]
+        return pdfs
+
+    def reduce_chunks(self, func, seed=None):
+        """
+        Function to sum contributions of all chunks of galaxies, in parallel
+        over chunks when more than one thread is available
+
+        Parameters
+        ----------
+        func: function
+            function of the kernel and log scales of a chunk, as returned by
+            log_z_dens.get_kernel, returning a tuple of contributions
+        seed: int, optional
+            root seed from which to give each of a fixed set of chunks its own
+            numpy.random.RandomState, passed to func as keyword random_state,
+            so that random contributions do not depend on the number of
+            threads or their scheduling
+
+        Returns
+        -------
+        totals: list
+            sums of each contribution over all chunks
+        """
+        def _chunk_func(item):
+            (index, chunk) = item
+            if seed is None:
+                return func(*self.get_kernel(chunk))
+            random_state = np.random.RandomState(su.chunk_seed(seed, index))
+            return func(*self.get_kernel(chunk), random_state=random_state)
+        if seed is None:
+            items = list(enumerate(self.chunks))
+        else:
+            items = list(enumerate(self.random_chunks))
+        # threads do not survive forking, so worker processes of a sampler work serially
+        if self.pool is None or os.getpid() != self.pool_pid:
+            results = [_chunk_func(item) for item in items]
+        else:
+            results = self.pool.map(_chunk_func, items)
+        totals = [sum(contributions) for contributions in zip(*results)]
+        return totals
 
     def evaluate_log_hyper_likelihood(self, log_nz):
         """
@@ -132,14 +274,112 @@ class log_z_dens(object):
         nz = np.exp(log_nz)
         norm_nz = nz / np.dot(nz, self.bin_difs)
 
-        # testing whether the norm step is still necessary
-        hyper_lfs = np.sum(norm_nz[None,:] * self.pdfs / self.int_pr[None,:] * self.bin_difs, axis=1)
-        log_hyper_likelihood = np.sum(u.safe_log(hyper_lfs)) - u.safe_log(np.dot(norm_nz, self.bin_difs))
+        def _chunk_contributions(kernel, log_scales):
+            hyper_lfs = np.dot(kernel, norm_nz)
+            return (np.sum(u.safe_log(hyper_lfs) + log_scales),)
 
-        # this used to work...
-        # log_hyper_likelihood = np.dot(np.exp(log_nz + self.precomputed), self.bin_difs)
+        # testing whether the norm step is still necessary
+        (log_hyper_likelihood,) = self.reduce_chunks(_chunk_contributions)
+        log_hyper_likelihood -= u.safe_log(np.dot(norm_nz, self.bin_difs))
         return log_hyper_likelihood
 
+    def evaluate_log_hyper_likelihood_gradient(self, log_nz):
+        """
+        Function to evaluate gradient of log hyperlikelihood
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+            the gradient
+
+        Returns
+        -------
+        grad: numpy.ndarray, float
+            derivatives of log hyperlikelihood with respect to log_nz
+
+        Notes
+        -----
+        The normalization term of the log hyperlikelihood is constant because
+        n(z) is normalized before evaluation, so only the derivative of the
+        normalization itself enters, through the Jacobian of norm_nz.
+        """
+        nz = np.exp(log_nz)
+        norm_nz = nz / np.dot(nz, self.bin_difs)
+
+        def _chunk_contributions(kernel, log_scales):
+            hyper_lfs = np.dot(kernel, norm_nz)
+            inv_lfs = np.zeros_like(hyper_lfs)
+            unclipped = hyper_lfs >= d.eps
+            inv_lfs[unclipped] = 1. / hyper_lfs[unclipped]
+            return (np.dot(inv_lfs, kernel),)
+
+        (weights,) = self.reduce_chunks(_chunk_contributions)
+        grad = norm_nz * (weights - self.bin_difs * np.dot(weights, norm_nz))
+        return grad
+
+    def evaluate_log_hyper_likelihood_hessian(self, log_nz):
+        """
+        Function to evaluate Hessian of log hyperlikelihood
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+            the Hessian
+
+        Returns
+        -------
+        hess: numpy.ndarray, float
+            (n_bins, n_bins) matrix of second derivatives of log
+            hyperlikelihood with respect to log_nz
+        """
+        nz = np.exp(log_nz)
+        norm_nz = nz / np.dot(nz, self.bin_difs)
+
+        def _chunk_contributions(kernel, log_scales):
+            hyper_lfs = np.dot(kernel, norm_nz)
+            inv_lfs = np.zeros_like(hyper_lfs)
+            unclipped = hyper_lfs >= d.eps
+            inv_lfs[unclipped] = 1. / hyper_lfs[unclipped]
+            weighted_kernel = kernel * inv_lfs[:, np.newaxis]
+            return (np.sum(weighted_kernel, axis=0), np.dot(weighted_kernel.T, weighted_kernel))
+
+        (weights, curvature) = self.reduce_chunks(_chunk_contributions)
+        total = np.dot(weights, norm_nz)
+        # Jacobian of norm_nz with respect to log_nz
+        jac = np.diag(norm_nz) - np.outer(norm_nz, norm_nz * self.bin_difs)
+        # Jacobian of weights with respect to log_nz
+        weights_jac = -1. * np.dot(curvature, jac)
+        total_grad = np.dot(norm_nz, weights_jac) + np.dot(weights, jac)
+
+        hess = jac * (weights - self.bin_difs * total)[:, np.newaxis]
+        hess += norm_nz[:, np.newaxis] * (weights_jac - np.outer(self.bin_difs, total_grad))
+        return hess
+
+    def set_hyper_prior(self, hyperprior):
+        """
+        Function to replace the hyperprior, forgetting the estimators that
+        depend on it so that they are recalculated
+
+        Parameters
+        ----------
+        hyperprior: chippr.mvn object
+            multivariate Gaussian distribution for hyperprior distribution
+
+        Notes
+        -----
+        The optimum found under the previous hyperprior stays available as
+        log_z_dens.log_mle_nz, from which calculate_mmle_multistart warm
+        starts by default.
+        """
+        self.hyper_prior = hyperprior
+        for key in ['log_mmle_nz', 'log_mmle_nz_multistart', 'log_mean_sampled_nz']:
+            self.info['estimators'].pop(key, None)
+        for key in ['log_mmle_nz_meta_data', 'log_mmle_nz_multistart_meta_data', 'log_sampled_nz_meta_data']:
+            self.info.pop(key, None)
+        return
+
     def evaluate_log_hyper_prior(self, log_nz):
         """
         Function to evaluate log hyperprior
@@ -155,9 +395,46 @@ class log_z_dens(object):
         log_hyper_prior: float
             log prior probability associated with parameters in log_nz
         """
-        log_hyper_prior = u.safe_log(self.hyper_prior.evaluate_one(log_nz))
+        log_hyper_prior = self.hyper_prior.evaluate_log(log_nz)
         return log_hyper_prior
 
+    def evaluate_log_hyper_prior_gradient(self, log_nz):
+        """
+        Function to evaluate gradient of log hyperprior
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+            the gradient
+
+        Returns
+        -------
+        grad: numpy.ndarray, float
+            derivatives of log hyperprior with respect to log_nz
+        """
+        grad = self.hyper_prior.evaluate_log_gradient(log_nz)
+        return grad
+
+    def evaluate_log_hyper_prior_hessian(self, log_nz):
+        """
+        Function to evaluate Hessian of log hyperprior
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+            the Hessian
+
+        Returns
+        -------
+        hess: numpy.ndarray, float
+            (n_bins, n_bins) matrix of second derivatives of log hyperprior
+            with respect to log_nz
+        """
+        hess = self.hyper_prior.evaluate_log_hessian(log_nz)
+        return hess
+
     def evaluate_log_hyper_posterior(self, log_nz):
         """
         Function to evaluate log hyperposterior
@@ -178,7 +455,455 @@ class log_z_dens(object):
         log_hyper_posterior = log_hyper_likelihood + log_hyper_prior
         return log_hyper_posterior
 
-    def optimize(self, start, no_data, no_prior, vb=True):
+    def evaluate_log_hyper_posterior_gradient(self, log_nz):
+        """
+        Function to evaluate gradient of log hyperposterior
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+            the gradient
+
+        Returns
+        -------
+        grad: numpy.ndarray, float
+            derivatives of log hyperposterior with respect to log_nz
+        """
+        grad = self.evaluate_log_hyper_likelihood_gradient(log_nz)
+        grad += self.evaluate_log_hyper_prior_gradient(log_nz)
+        return grad
+
+    def evaluate_log_hyper_posterior_hessian(self, log_nz):
+        """
+        Function to evaluate Hessian of log hyperposterior
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+            the Hessian
+
+        Returns
+        -------
+        hess: numpy.ndarray, float
+            (n_bins, n_bins) matrix of second derivatives of log
+            hyperposterior with respect to log_nz
+        """
+        hess = self.evaluate_log_hyper_likelihood_hessian(log_nz)
+        hess += self.evaluate_log_hyper_prior_hessian(log_nz)
+        return hess
+
+    def evaluate_log_hyper_likelihood_batch(self, log_nz_matrix):
+        """
+        Function to evaluate log hyperlikelihood at many points at once
+
+        Parameters
+        ----------
+        log_nz_matrix: numpy.ndarray, float
+            (n_points, n_bins) array of logged redshift density bin values at
+            which to evaluate the hyperlikelihood
+
+        Returns
+        -------
+        log_hyper_likelihoods: numpy.ndarray, float
+            log likelihood probabilities associated with each row of
+            log_nz_matrix
+        """
+        nzs = np.exp(log_nz_matrix)
+        norm_nzs = nzs / np.dot(nzs, self.bin_difs)[:, np.newaxis]
+
+        def _chunk_contributions(kernel, log_scales):
+            hyper_lfs = np.dot(kernel, norm_nzs.T)
+            return (np.sum(u.safe_log(hyper_lfs), axis=0) + np.sum(log_scales),)
+
+        (log_hyper_likelihoods,) = self.reduce_chunks(_chunk_contributions)
+        log_hyper_likelihoods -= u.safe_log(np.dot(norm_nzs, self.bin_difs))
+        return log_hyper_likelihoods
+
+    def evaluate_log_hyper_prior_batch(self, log_nz_matrix):
+        """
+        Function to evaluate log hyperprior at many points at once
+
+        Parameters
+        ----------
+        log_nz_matrix: numpy.ndarray, float
+            (n_points, n_bins) array of logged redshift density bin values at
+            which to evaluate the hyperprior
+
+        Returns
+        -------
+        log_hyper_priors: numpy.ndarray, float
+            log prior probabilities associated with each row of log_nz_matrix
+        """
+        log_hyper_priors = self.hyper_prior.evaluate_log(log_nz_matrix)
+        return log_hyper_priors
+
+    def evaluate_log_hyper_posterior_batch(self, log_nz_matrix):
+        """
+        Function to evaluate log hyperposterior at many points at once, i.e.
+        for all walkers of an ensemble sampler
+
+        Parameters
+        ----------
+        log_nz_matrix: numpy.ndarray, float
+            (n_points, n_bins) array of logged redshift density bin values at
+            which to evaluate the full posterior
+
+        Returns
+        -------
+        log_hyper_posteriors: numpy.ndarray, float
+            log hyperposterior probabilities associated with each row of
+            log_nz_matrix
+        """
+        log_hyper_likelihoods = self.evaluate_log_hyper_likelihood_batch(log_nz_matrix)
+        log_hyper_priors = self.evaluate_log_hyper_prior_batch(log_nz_matrix)
+        log_hyper_posteriors = log_hyper_likelihoods + log_hyper_priors
+        return log_hyper_posteriors
+
+    def evaluate_em_update(self, norm_nz):
+        """
+        Function performing one expectation-maximization update of the
+        redshift density under a flat hyperprior, reweighting every interim
+        posterior by n(z) over the interim prior and averaging
+
+        Parameters
+        ----------
+        norm_nz: numpy.ndarray, float
+            vector of normalized redshift density bin values to update
+
+        Returns
+        -------
+        new_nz: numpy.ndarray, float
+            vector of updated normalized redshift density bin values
+        log_hyper_likelihood: float
+            log hyperlikelihood of the input norm_nz
+        """
+        def _chunk_contributions(kernel, log_scales):
+            hyper_lfs = np.dot(kernel, norm_nz)
+            inv_lfs = np.zeros_like(hyper_lfs)
+            unclipped = hyper_lfs >= d.eps
+            inv_lfs[unclipped] = 1. / hyper_lfs[unclipped]
+            return (np.dot(inv_lfs, kernel), np.sum(u.safe_log(hyper_lfs) + log_scales))
+
+        (weights, log_hyper_likelihood) = self.reduce_chunks(_chunk_contributions)
+        new_nz = norm_nz * weights
+        new_nz /= np.dot(new_nz, self.bin_difs)
+        return (new_nz, log_hyper_likelihood)
+
+    def sample_bin_counts(self, norm_nz_matrix, seed=None):
+        """
+        Function drawing the bin of every galaxy from its interim posterior
+        reweighted by n(z) over the interim prior, for several n(z) at once
+
+        Parameters
+        ----------
+        norm_nz_matrix: numpy.ndarray, float
+            (n_chains, n_bins) array of normalized redshift density bin values
+        seed: int, optional
+            root seed of the independent random streams of the chunks,
+            drawn from numpy.random if not given
+
+        Returns
+        -------
+        counts: numpy.ndarray, int
+            (n_chains, n_bins) number of galaxies drawn in each bin
+
+        Notes
+        -----
+        Each chunk draws one chain at a time, so no more than a chunk's
+        kernel is held in memory at once.
+        """
+        norm_nz_matrix = np.atleast_2d(norm_nz_matrix)
+        n_chains = len(norm_nz_matrix)
+        if seed is None:
+            seed = np.random.randint(np.iinfo(np.int32).max)
+
+        def _chunk_contributions(kernel, log_scales, random_state=np.random):
+            counts = np.empty((n_chains, self.n_bins), dtype=int)
+            for (c, norm_nz) in enumerate(norm_nz_matrix):
+                cdfs = np.cumsum(kernel * norm_nz[np.newaxis, :], axis=1)
+                draws = random_state.uniform(size=len(cdfs)) * cdfs[:, -1]
+                bins = np.minimum(np.sum(cdfs < draws[:, np.newaxis], axis=1), self.n_bins - 1)
+                counts[c] = np.bincount(bins, minlength=self.n_bins)
+            return (counts,)
+
+        (counts,) = self.reduce_chunks(_chunk_contributions, seed=seed)
+        return counts
+
+    def optimize_em(self, start, tol=d.em_tol, max_evals=d.mmle_max_evals, accelerate=False, vb=True):
+        """
+        Maximizes the hyperlikelihood of the redshift density by
+        expectation-maximization, optionally with SQUAREM extrapolation
+
+        Parameters
+        ----------
+        start: numpy.ndarray, float
+            array of log redshift density function bin values at which to begin
+            iterating
+        tol: float, optional
+            change in log hyperlikelihood between iterations below which to
+            stop
+        max_evals: int, optional
+            budget of expectation-maximization updates, i.e. passes over the
+            catalog
+        accelerate: boolean, optional
+            True to use squared iterative extrapolation (SQUAREM, Varadhan &
+            Roland 2008), False for plain fixed-point iterations
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+
+        Returns
+        -------
+        log_nz: numpy.ndarray, float
+            array of logged redshift density function bin values maximizing
+            hyperlikelihood
+        cost: dict
+            numbers of evaluations and iterations, wall time in seconds, and
+            convergence status of the iterations
+        """
+        start_time = timeit.default_timer()
+        nz = np.exp(start)
+        nz /= np.dot(nz, self.bin_difs)
+
+        n_evals, n_iterations = 0, 0
+        success = False
+        (new_nz, log_hyper_likelihood) = self.evaluate_em_update(nz)
+        n_evals += 1
+        while n_evals < max_evals:
+            # an extrapolation cycle takes two updates, so the last one of the budget is plain
+            if accelerate and n_evals + 2 <= max_evals:
+                (next_nz, next_log_hyper_likelihood) = self.evaluate_em_update(new_nz)
+                n_evals += 1
+                r = new_nz - nz
+                v = next_nz - new_nz - r
+                alpha = min(-1., -1. * np.sqrt(np.dot(r, r) / max(np.dot(v, v), d.eps)))
+                extrapolated = nz - 2. * alpha * r + alpha ** 2 * v
+                # step back toward the plain double update until n(z) is positive
+                while np.any(extrapolated <= 0.) and alpha < -1.:
+                    alpha = min(-1., (alpha - 1.) / 2.)
+                    extrapolated = nz - 2. * alpha * r + alpha ** 2 * v
+                extrapolated /= np.dot(extrapolated, self.bin_difs)
+                (candidate_nz, candidate_log_hyper_likelihood) = self.evaluate_em_update(extrapolated)
+                n_evals += 1
+                # fall back on the monotonic double update if extrapolation overshot
+                if candidate_log_hyper_likelihood < next_log_hyper_likelihood:
+                    (nz, new_nz, new_log_hyper_likelihood) = (new_nz, next_nz, next_log_hyper_likelihood)
+                else:
+                    (nz, new_nz, new_log_hyper_likelihood) = (extrapolated, candidate_nz, candidate_log_hyper_likelihood)
+            else:
+                nz = new_nz
+                (new_nz, new_log_hyper_likelihood) = self.evaluate_em_update(nz)
+                n_evals += 1
+            n_iterations += 1
+            converged = np.abs(new_log_hyper_likelihood - log_hyper_likelihood) < tol
+            log_hyper_likelihood = new_log_hyper_likelihood
+            if converged:
+                success = True
+                break
+        wall_time = timeit.default_timer() - start_time
+
+        cost = {}
+        cost['method'] = 'em'
+        cost['n_evals'] = n_evals
+        cost['n_iterations'] = n_iterations
+        cost['n_gradient_evals'] = 0
+        cost['n_hessian_evals'] = 0
+        cost['wall_time'] = wall_time
+        cost['success'] = success
+        if success:
+            cost['message'] = 'change in log hyperlikelihood below tolerance'
+        else:
+            cost['message'] = 'maximum number of evaluations exceeded'
+
+        if vb:
+            print(self.dir + ': expectation-maximization ' + cost['message'] + ' with log hyperlikelihood ' + str(log_hyper_likelihood))
+            print('em used ' + str(n_evals) + ' evaluations in ' + str(n_iterations) + ' iterations and ' + str(wall_time) + ' s')
+        log_nz = u.safe_log(nz)
+        return (log_nz, cost)
+
+    def make_anchor(self, log_nz):
+        """
+        Function to evaluate the hyperlikelihood over the whole catalog at a
+        reference point, around which minibatch estimates are control variates
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values of the reference point
+
+        Returns
+        -------
+        anchor: dict
+            the reference point, its normalized n(z), and the log
+            hyperlikelihood and summed inverse-likelihood-weighted kernel there
+        """
+        nz = np.exp(log_nz)
+        norm_nz = nz / np.dot(nz, self.bin_difs)
+
+        def _chunk_contributions(kernel, log_scales):
+            hyper_lfs = np.dot(kernel, norm_nz)
+            inv_lfs = np.zeros_like(hyper_lfs)
+            unclipped = hyper_lfs >= d.eps
+            inv_lfs[unclipped] = 1. / hyper_lfs[unclipped]
+            return (np.dot(inv_lfs, kernel), np.sum(u.safe_log(hyper_lfs) + log_scales))
+
+        (weights, log_hyper_likelihood) = self.reduce_chunks(_chunk_contributions)
+        anchor = {'log_nz': np.array(log_nz), 'norm_nz': norm_nz, 'weights': weights,
+                  'log_hyper_likelihood': log_hyper_likelihood}
+        return anchor
+
+    def evaluate_minibatch(self, log_nz, batch, anchor=None):
+        """
+        Function to estimate the log hyperlikelihood and its gradient from a
+        random subset of galaxies
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values at which to evaluate
+        batch: numpy.ndarray, int
+            indices of galaxies drawn uniformly with replacement
+        anchor: dict, optional
+            whole-catalog evaluation from log_z_dens.make_anchor, whose
+            per-galaxy terms are subtracted as control variates
+
+        Returns
+        -------
+        log_hyper_likelihood: float
+            unbiased estimate of the log hyperlikelihood
+        grad: numpy.ndarray, float
+            unbiased estimate of its derivatives with respect to log_nz
+
+        Notes
+        -----
+        The gradient is linear in the summed inverse-likelihood-weighted
+        kernel, so an unbiased estimate of that sum gives an unbiased
+        gradient.  Per-galaxy kernel rescalings cancel from both control
+        variate differences.
+        """
+        nz = np.exp(log_nz)
+        norm_nz = nz / np.dot(nz, self.bin_difs)
+        scale = float(self.n_pdfs) / len(batch)
+        (kernel, log_scales) = self.get_kernel(batch)
+
+        def _terms(norm_nz):
+            hyper_lfs = np.dot(kernel, norm_nz)
+            inv_lfs = np.zeros_like(hyper_lfs)
+            unclipped = hyper_lfs >= d.eps
+            inv_lfs[unclipped] = 1. / hyper_lfs[unclipped]
+            return (u.safe_log(hyper_lfs), np.dot(inv_lfs, kernel))
+
+        (log_lfs, weights) = _terms(norm_nz)
+        if anchor is None:
+            log_hyper_likelihood = scale * np.sum(log_lfs + log_scales)
+            weights = scale * weights
+        else:
+            (anchor_log_lfs, anchor_weights) = _terms(anchor['norm_nz'])
+            log_hyper_likelihood = anchor['log_hyper_likelihood'] + scale * np.sum(log_lfs - anchor_log_lfs)
+            weights = anchor['weights'] + scale * (weights - anchor_weights)
+        grad = norm_nz * (weights - self.bin_difs * np.dot(weights, norm_nz))
+        return (log_hyper_likelihood, grad)
+
+    def fit_normalization(self, log_nz):
+        """
+        Function to shift logged redshift density bin values uniformly to the
+        maximum of the hyperprior along that direction, to which the
+        hyperlikelihood and its minibatch estimates are blind
+
+        Parameters
+        ----------
+        log_nz: numpy.ndarray, float
+            vector of logged redshift density bin values
+
+        Returns
+        -------
+        log_nz: numpy.ndarray, float
+            vector shifted by one Newton step along the uniform direction, which
+            is exact for a Gaussian hyperprior
+        """
+        curvature = np.sum(self.evaluate_log_hyper_prior_hessian(log_nz))
+        if curvature < 0.:
+            log_nz = log_nz - np.sum(self.evaluate_log_hyper_prior_gradient(log_nz)) / curvature
+        return log_nz
+
+    def optimize_stochastic(self, start, no_prior=0, batch_size=d.sg_batch_size, n_iterations=d.sg_n_iterations, learning_rate=d.adam_learning_rate, anchor_every=None, vb=True):
+        """
+        Maximizes the hyperposterior of the redshift density by Adam steps
+        along minibatch gradients
+
+        Parameters
+        ----------
+        start: numpy.ndarray, float
+            array of log redshift density function bin values at which to begin
+        no_prior: boolean, optional
+            True to exclude prior contribution to hyperposterior
+        batch_size: int, optional
+            number of galaxies per minibatch
+        n_iterations: int, optional
+            number of Adam steps
+        learning_rate: float, optional
+            Adam step size
+        anchor_every: int, optional
+            number of steps between whole-catalog control variate
+            evaluations, defaults to none
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+
+        Returns
+        -------
+        log_nz: numpy.ndarray, float
+            average of the iterates of the second half of the optimization
+        cost: dict
+            number of iterations, galaxies touched, whole-catalog passes, wall
+            time, and the drift between the averages of the last two quarters
+            of the iterates with whether it is within d.sg_tol
+
+        Notes
+        -----
+        Adam only moves the shape of n(z), while the overall normalization is
+        set by the hyperprior after every step.
+        """
+        start_time = timeit.default_timer()
+        log_nz = np.array(start, dtype=float)
+        optimizer = iu.adam(learning_rate=learning_rate)
+        anchor = None
+        n_passes = 0
+        n_averaged = [0, 0]
+        averages = [0., 0.]
+        for i in range(n_iterations):
+            if anchor_every is not None and i % anchor_every == 0:
+                anchor = self.make_anchor(log_nz)
+                n_passes += 1
+            batch = np.sort(np.random.randint(self.n_pdfs, size=batch_size))
+            grad = self.evaluate_minibatch(log_nz, batch, anchor=anchor)[1]
+            if not no_prior:
+                grad += self.evaluate_log_hyper_prior_gradient(log_nz)
+            log_nz += optimizer.step(-grad)
+            if not no_prior:
+                log_nz = self.fit_normalization(log_nz)
+            if i >= n_iterations // 2:
+                quarter = int(i >= (3 * n_iterations) // 4)
+                n_averaged[quarter] += 1
+                averages[quarter] += (log_nz - averages[quarter]) / n_averaged[quarter]
+        average = (n_averaged[0] * averages[0] + n_averaged[1] * averages[1]) / sum(n_averaged)
+        shapes = [quarter - u.safe_log(np.dot(np.exp(quarter), self.bin_difs)) for quarter in averages]
+
+        cost = {}
+        cost['method'] = 'adam'
+        cost['n_iterations'] = n_iterations
+        cost['n_galaxies_touched'] = n_iterations * batch_size
+        cost['n_passes'] = n_passes
+        cost['wall_time'] = timeit.default_timer() - start_time
+        cost['drift'] = np.max(np.abs(shapes[1] - shapes[0]))
+        cost['converged'] = cost['drift'] <= d.sg_tol
+        if vb:
+            print('stochastic optimization took '+str(n_iterations)+' steps over '+str(cost['n_galaxies_touched'])+' galaxies in '+str(cost['wall_time'])+' s')
+            if not cost['converged']:
+                print('stochastic optimization may not have converged, with log n(z) drifting by '+str(cost['drift'])+' between the last two quarters of steps; consider more n_iterations or anchor_every')
+        return (average, cost)
+
+    def optimize(self, start, no_data, no_prior, method=d.mmle_method, tol=None, max_evals=d.mmle_max_evals, accelerate=False, vb=True):
         """
         Maximizes the hyperposterior of the redshift density
 
@@ -191,6 +916,18 @@ class log_z_dens(object):
             True to exclude data contribution to hyperposterior
         no_prior: boolean
             True to exclude prior contribution to hyperposterior
+        method: string, optional
+            scipy.optimize.minimize backend, one of 'Nelder-Mead' (derivative
+            free), 'L-BFGS-B' (analytic gradient), 'Newton-CG' or
+            'trust-constr' (analytic gradient and Hessian), or 'em' for
+            expectation-maximization, which requires no_prior
+        tol: float, optional
+            tolerance for termination, defaults to that of the backend
+        max_evals: int, optional
+            budget of objective evaluations, or of iterations for backends
+            that do not count evaluations
+        accelerate: boolean, optional
+            True to use SQUAREM extrapolation when method is 'em'
         vb: boolean, optional
             True to print progress messages to stdout, False to suppress
 
@@ -199,30 +936,79 @@ class log_z_dens(object):
         res.x: numpy.ndarray, float
             array of logged redshift density function bin values maximizing
             hyperposterior
+        cost: dict
+            numbers of evaluations and iterations, wall time in seconds, and
+            convergence status of the optimization
         """
+        if method == 'em':
+            if no_data or not no_prior:
+                raise ValueError('expectation-maximization only maximizes the hyperlikelihood, set no_prior')
+            if vb: print('only optimizing likelihood')
+            if tol is None:
+                tol = d.em_tol
+            return self.optimize_em(start, tol=tol, max_evals=max_evals, accelerate=accelerate, vb=vb)
+
         if no_data:
             if vb: print('only optimizing prior')
-            def _objective(log_nz):
-                return -2. * self.evaluate_log_hyper_prior(log_nz)
+            component = 'prior'
         elif no_prior:
             if vb: print('only optimizing likelihood')
-            def _objective(log_nz):
-                return -2. * self.evaluate_log_hyper_likelihood(log_nz)
+            component = 'likelihood'
         else:
             if vb: print('optimizing posterior')
-            def _objective(log_nz):
-                return -2. * self.evaluate_log_hyper_posterior(log_nz)
+            component = 'posterior'
+        log_prob = getattr(self, 'evaluate_log_hyper_' + component)
+        log_prob_gradient = getattr(self, 'evaluate_log_hyper_' + component + '_gradient')
+        log_prob_hessian = getattr(self, 'evaluate_log_hyper_' + component + '_hessian')
+
+        # scipy does not report gradient evaluations for every backend, so count all calls here
+        n_calls = {'objective': 0, 'gradient': 0, 'hessian': 0}
+        def _objective(log_nz):
+            n_calls['objective'] += 1
+            return -2. * log_prob(log_nz)
+        def _gradient(log_nz):
+            n_calls['gradient'] += 1
+            return -2. * log_prob_gradient(log_nz)
+        def _hessian(log_nz):
+            n_calls['hessian'] += 1
+            return -2. * log_prob_hessian(log_nz)
+
+        if method == 'Nelder-Mead':
+            derivatives = {}
+            options = {'maxfev': max_evals, 'maxiter': max_evals}
+        elif method == 'L-BFGS-B':
+            derivatives = {'jac': _gradient}
+            options = {'maxfun': max_evals, 'maxiter': max_evals}
+        elif method in ['Newton-CG', 'trust-constr']:
+            derivatives = {'jac': _gradient, 'hess': _hessian}
+            options = {'maxiter': max_evals}
+        else:
+            raise ValueError('unsupported optimization method ' + str(method))
 
         if vb:
             print(self.dir + ' starting at ', start, _objective(start))
 
-        res = op.minimize(_objective, start, method="Nelder-Mead", options={"maxfev": 1e5, "maxiter":1e5})
+        n_calls.update(objective=0, gradient=0, hessian=0)
+        start_time = timeit.default_timer()
+        res = op.minimize(_objective, start, method=method, tol=tol, options=options, **derivatives)
+        wall_time = timeit.default_timer() - start_time
+
+        cost = {}
+        cost['method'] = method
+        cost['n_evals'] = n_calls['objective']
+        cost['n_iterations'] = res.nit
+        cost['n_gradient_evals'] = n_calls['gradient']
+        cost['n_hessian_evals'] = n_calls['hessian']
+        cost['wall_time'] = wall_time
+        cost['success'] = res.success
+        cost['message'] = res.message
 
         if vb:
             print(self.dir + ': ' + str(res))
-        return res.x
+            print(method + ' used ' + str(cost['n_evals']) + ' evaluations in ' + str(cost['n_iterations']) + ' iterations and ' + str(wall_time) + ' s')
+        return (res.x, cost)
 
-    def calculate_mmle(self, start, vb=True, no_data=0, no_prior=0):
+    def calculate_mmle(self, start, vb=True, no_data=0, no_prior=0, method=d.mmle_method, tol=None, max_evals=d.mmle_max_evals, accelerate=False):
         """
         Calculates the marginalized maximum likelihood estimator of the
         redshift density function
@@ -238,6 +1024,14 @@ class log_z_dens(object):
             True to exclude data contribution to hyperposterior
         no_prior: boolean, optional
             True to exclude prior contribution to hyperposterior
+        method: string, optional
+            optimization backend, see log_z_dens.optimize
+        tol: float, optional
+            tolerance for termination of optimization
+        max_evals: int, optional
+            budget of evaluations for optimization
+        accelerate: boolean, optional
+            True to use SQUAREM extrapolation when method is 'em'
 
         Returns
         -------
@@ -245,19 +1039,129 @@ class log_z_dens(object):
             array of logged redshift density function bin values maximizing
             hyperposterior
         """
-        # self.precomputed = self.precompute()
         if 'log_mmle_nz' not in self.info['estimators']:
-            log_mle = self.optimize(start, no_data=no_data, no_prior=no_prior, vb=vb)
+            (log_mle, cost) = self.optimize(start, no_data=no_data, no_prior=no_prior, method=method, tol=tol, max_evals=max_evals, accelerate=accelerate, vb=vb)
             mle_nz = np.exp(log_mle)
             self.mle_nz = mle_nz / np.dot(mle_nz, self.bin_difs)
             self.log_mle_nz = u.safe_log(self.mle_nz)
             self.info['estimators']['log_mmle_nz'] = self.log_mle_nz
+            self.info['log_mmle_nz_meta_data'] = cost
         else:
             self.log_mle_nz = self.info['estimators']['log_mmle_nz']
             self.mle_nz = np.exp(self.log_mle_nz)
 
         return self.log_mle_nz
 
+    def calculate_mmle_multistart(self, starts=None, n_draws=d.n_mmle_draws, warm_starts=None, vb=True, no_data=0, no_prior=0, method=d.mmle_method, tol=None, max_evals=d.mmle_max_evals, n_procs=1, executor=None):
+        """
+        Calculates the marginalized maximum likelihood estimator from several
+        starting points at once, keeping the best optimum and the spread of
+        all of them
+
+        Parameters
+        ----------
+        starts: dict, optional
+            arrays of log redshift density function bin values at which to
+            begin optimizing, keyed by name, defaults to the stacked and MMAP
+            estimators, the interim prior and draws from the hyperprior
+        n_draws: int, optional
+            number of default starting points drawn from the hyperprior
+        warm_starts: numpy.ndarray, float, optional
+            optima of an earlier run, for example with a different
+            hyperprior, to include as starting points, defaults to the
+            previous marginalized maximum likelihood estimator if there is one
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+        no_data: boolean, optional
+            True to exclude data contribution to hyperposterior
+        no_prior: boolean, optional
+            True to exclude prior contribution to hyperposterior
+        method: string, optional
+            optimization method, see log_z_dens.optimize
+        tol: float, optional
+            convergence tolerance passed to the optimizer
+        max_evals: int, optional
+            budget of evaluations for each optimization
+        n_procs: int, optional
+            number of worker processes to fork over which to split the starting
+            points, defaults to optimizing serially
+        executor: object, optional
+            pool of workers with a map method to use instead of forked
+            processes
+
+        Returns
+        -------
+        log_mle_nz: numpy.ndarray, float
+            array of logged redshift density function bin values maximizing
+            hyperposterior over all starting points
+
+        Notes
+        -----
+        The best optimum is cached separately from calculate_mmle, which it
+        also replaces; use log_z_dens.set_hyper_prior to rerun under a new
+        hyperprior.
+        """
+        if 'log_mmle_nz_multistart' not in self.info['estimators']:
+            if warm_starts is None:
+                if 'log_mmle_nz' in self.info['estimators']:
+                    warm_starts = self.info['estimators']['log_mmle_nz']
+                elif hasattr(self, 'log_mle_nz'):
+                    warm_starts = self.log_mle_nz
+            if starts is None:
+                starts = {}
+                starts['stacked'] = self.calculate_stacked(vb=False)
+                starts['mmap'] = self.calculate_mmap(vb=False)
+                starts['interim_prior'] = self.log_int_pr
+                if n_draws > 0:
+                    for (i, draw) in enumerate(np.atleast_2d(self.hyper_prior.sample(n_draws))):
+                        starts['prior_draw_'+str(i)] = draw
+            if warm_starts is not None:
+                for (i, warm_start) in enumerate(np.atleast_2d(warm_starts)):
+                    starts['warm_'+str(i)] = warm_start
+            names = sorted(starts.keys())
+            if no_data:
+                log_prob = self.evaluate_log_hyper_prior
+            elif no_prior:
+                log_prob = self.evaluate_log_hyper_likelihood
+            else:
+                log_prob = self.evaluate_log_hyper_posterior
+
+            def _optimize_from(name):
+                (log_mle, cost) = self.optimize(starts[name], no_data=no_data, no_prior=no_prior, method=method, tol=tol, max_evals=max_evals, vb=False)
+                mle_nz = np.exp(log_mle)
+                log_mle = u.safe_log(mle_nz / np.dot(mle_nz, self.bin_difs))
+                cost['log_prob'] = log_prob(log_mle)
+                return (log_mle, cost)
+
+            start_time = timeit.default_timer()
+            results = iu.parallel_map(_optimize_from, names, n_procs=n_procs, executor=executor)
+            optima = np.array([result[0] for result in results])
+            log_probs = np.array([result[1]['log_prob'] for result in results])
+            best = np.argmax(log_probs)
+            meta = {}
+            meta['names'] = names
+            meta['starts'] = np.array([starts[name] for name in names])
+            meta['optima'] = optima
+            meta['log_probs'] = log_probs
+            meta['costs'] = [result[1] for result in results]
+            meta['best'] = names[best]
+            meta['spread'] = np.std(optima, axis=0)
+            meta['log_prob_range'] = log_probs[best] - np.min(log_probs)
+            meta['wall_time'] = timeit.default_timer() - start_time
+            if vb:
+                print('best optimum from '+names[best]+' of '+str(len(names))+' starting points, with spread '+str(meta['spread'])+' and log-probability range '+str(meta['log_prob_range']))
+            self.log_mle_nz = optima[best]
+            self.mle_nz = np.exp(self.log_mle_nz)
+            self.info['estimators']['log_mmle_nz'] = self.log_mle_nz
+            self.info['estimators']['log_mmle_nz_multistart'] = self.log_mle_nz
+            self.info['log_mmle_nz_meta_data'] = meta['costs'][best]
+            self.info['log_mmle_nz_multistart_meta_data'] = meta
+        else:
+            self.log_mle_nz = self.info['estimators']['log_mmle_nz_multistart']
+            self.mle_nz = np.exp(self.log_mle_nz)
+
+        return self.log_mle_nz
+
     def calculate_stacked(self, vb=True):
         """
         Calculates the stacked estimator of the redshift density function
@@ -273,7 +1177,9 @@ class log_z_dens(object):
             array of logged redshift density function bin values
         """
         if 'log_stacked_nz' not in self.info['estimators']:
-            self.stk_nz = np.sum(self.pdfs, axis=0)
+            self.stk_nz = np.zeros(self.n_bins)
+            for chunk in self.chunks:
+                self.stk_nz += np.sum(self.get_pdfs(chunk), axis=0)
             self.stk_nz /= np.dot(self.stk_nz, self.bin_difs)
             self.log_stk_nz = u.safe_log(self.stk_nz)
             self.info['estimators']['log_stacked_nz'] = self.log_stk_nz
@@ -300,7 +1206,9 @@ class log_z_dens(object):
         """
         if 'log_mmap_nz' not in self.info['estimators']:
             self.map_nz = np.zeros(self.n_bins)
-            mappreps = [np.argmax(l) for l in self.log_pdfs]
+            mappreps = []
+            for chunk in self.chunks:
+                mappreps.extend(np.argmax(self.log_pdfs[chunk], axis=1))
             for m in mappreps:
                 self.map_nz[m] += 1.
             self.map_nz /= self.bin_difs[m] * self.n_pdfs
@@ -328,7 +1236,9 @@ class log_z_dens(object):
             array of logged redshift density function bin values
         """
         if 'log_mexp_nz' not in self.info['estimators']:
-            expprep = [sum(z) for z in self.bin_mids * self.pdfs * self.bin_difs]
+            expprep = []
+            for chunk in self.chunks:
+                expprep.extend([sum(z) for z in self.bin_mids * self.get_pdfs(chunk) * self.bin_difs])
             self.exp_nz = np.zeros(self.n_bins)
             for z in expprep:
                 for k in range(self.n_bins):
@@ -343,7 +1253,7 @@ class log_z_dens(object):
 
         return self.log_exp_nz
 
-    def sample(self, ivals, n_samps, vb=True):
+    def sample(self, ivals, n_samps, chain_buffer=None, vb=True):
         """
         Samples the redshift density hyperposterior
 
@@ -353,6 +1263,9 @@ class log_z_dens(object):
             initial values of the walkers
         n_samps: int
             number of samples to accept before stopping
+        chain_buffer: chippr.chain_buffer object, optional
+            storage into which the sampler writes each step, defaults to a new
+            one holding only these samples
         vb: boolean, optional
             True to print progress messages to stdout, False to suppress
 
@@ -363,11 +1276,19 @@ class log_z_dens(object):
             bin values as well as posterior probabilities, acceptance
             fractions, and autocorrelation times
         """
-        self.sampler.reset()
-        pos, prob, state = self.sampler.run_mcmc(ivals, n_samps)
-        chains = self.sampler.chain
-        probs = self.sampler.lnprobability
-        fracs = self.sampler.acceptance_fraction
+        if chain_buffer is None:
+            chain_buffer = iu.chain_buffer(len(ivals), self.n_bins, capacity=n_samps)
+        chain_buffer.reserve(n_samps)
+        probs = np.empty((len(ivals), n_samps))
+        n_moves = np.zeros(len(ivals))
+        last_pos = np.array(ivals)
+        for (i, (pos, prob)) in enumerate(iu.sample_steps(self.sampler, ivals, n_samps)):
+            chain_buffer.append(pos)
+            probs[:, i] = prob
+            n_moves += np.any(pos != last_pos, axis=1)
+            last_pos = np.array(pos)
+        chains = chain_buffer.view(-n_samps)
+        fracs = n_moves / n_samps
         acors = s.acors(chains)
         mcmc_outputs = {}
         mcmc_outputs['chains'] = chains
@@ -376,7 +1297,7 @@ class log_z_dens(object):
         mcmc_outputs['acors'] = acors
         return mcmc_outputs
 
-    def calculate_samples(self, ivals, n_accepted=d.n_accepted, n_burned=d.n_burned, vb=True, n_procs=1, no_data=0, no_prior=0, gr_threshold=d.gr_threshold):
+    def calculate_samples(self, ivals, n_accepted=d.n_accepted, n_burned=d.n_burned, vb=True, n_procs=1, executor=None, no_data=0, no_prior=0, gr_threshold=d.gr_threshold, chain_loc=None, checkpoint=None, n_eff=None, max_time=None, max_evals=None):
         """
         Calculates samples estimating the redshift density function
 
@@ -389,82 +1310,733 @@ class log_z_dens(object):
         n_burned: int, optional
             log10 number of samples between tests of burn-in condition
         n_procs: int, optional
-            number of processors to use, defaults to single-thread
+            number of processors over which to split the walkers at each step,
+            defaults to single-process; worker processes are forked once and
+            share the catalog with this object
+        executor: object, optional
+            pool of workers with a map method, such as a
+            multiprocessing.pool.ThreadPool, to use instead of forked
+            processes, in which case n_procs is the number of walker subsets
         vb: boolean, optional
             True to print progress messages to stdout, False to suppress
         no_data: boolean, optional
             True to exclude data contribution to hyperposterior
         no_prior: boolean, optional
             True to exclude prior contribution to hyperposterior
+        gr_threshold: float, optional
+            Gelman-Rubin test statistic criterion for the end of burn-in
+        chain_loc: string, optional
+            file name in the results directory in which to memory-map the full
+            chain, defaults to keeping it in memory unless checkpointing
+        checkpoint: string, optional
+            file name in the results directory in which to save the state of
+            the sampler after every burn-in block, from which sampling resumes
+            if the file already exists; the chain is then memory-mapped, in
+            chippr.defaults.checkpoint_chain_loc if chain_loc is not given
+        n_eff: float, optional
+            effective number of samples in every bin at which to stop
+            sampling once the autocorrelation times have settled, checked
+            after every 10**n_burned steps, defaults to accepting 10**n_accepted
+            steps regardless
+        max_time: float, optional
+            wall time in seconds after which to end burn-in and sampling
+            toward n_eff, defaults to no limit
+        max_evals: int, optional
+            number of hyperposterior evaluations after which to end burn-in and
+            sampling toward n_eff, defaults to no limit
 
         Returns
         -------
         log_samples_nz: ndarray, float
             array of sampled log redshift density function bin values
+
+        Notes
+        -----
+        Each block of samples, normalized, is appended with its posterior
+        probabilities to a compressed chippr.chain_store in the chains
+        subdirectory of the results directory, with the accepted samples in
+        the last block.
         """
-        # self.precomputed = self.precompute()
         if 'log_mean_sampled_nz' not in self.info['estimators']:
+            start_time = timeit.default_timer()
+            def _out_of_budget():
+                out_of_time = max_time is not None and timeit.default_timer() - start_time >= max_time
+                out_of_evals = max_evals is not None and self.chain_buffer.n_steps * self.n_walkers >= max_evals
+                return out_of_time or out_of_evals
             self.n_walkers = len(ivals)
             if no_data:
-                def distribution(log_nz):
-                    return self.evaluate_log_hyper_prior(log_nz)
+                distribution = self.evaluate_log_hyper_prior_batch
             elif no_prior:
-                def distribution(log_nz):
-                    return self.evaluate_log_hyper_likelihood(log_nz)
+                distribution = self.evaluate_log_hyper_likelihood_batch
             else:
-                def distribution(log_nz):
-                    return self.evaluate_log_hyper_posterior(log_nz)
-            self.sampler = emcee.EnsembleSampler(self.n_walkers, self.n_bins, distribution, threads=n_procs)
-            self.burn_ins = 0
-            if n_burned == 0:
-                self.burning_in = False
+                distribution = self.evaluate_log_hyper_posterior_batch
+            (self.sampler, evaluator) = iu.make_sampler(self.n_walkers, self.n_bins, distribution, n_procs=n_procs, executor=executor)
+            if checkpoint is not None and chain_loc is None:
+                chain_loc = d.checkpoint_chain_loc
+            if chain_loc is not None:
+                chain_loc = os.path.join(self.res_dir, chain_loc)
+            if checkpoint is not None:
+                checkpoint = os.path.join(self.res_dir, checkpoint)
+            if checkpoint is not None and os.path.exists(checkpoint):
+                vals = self.read_checkpoint(checkpoint, capacity=10**n_burned + 10**n_accepted, vb=vb)
+                self.chain_store = iu.chain_store(os.path.join(self.res_dir, 'chains'))
+                self.chain_store.truncate(self.burn_ins)
+                if vb:
+                    canvas = plots.set_up_burn_in_plots(self.n_bins, self.n_walkers)
             else:
-                self.burning_in = True
-            vals = ivals
-            vals -= u.safe_log(np.sum(np.exp(ivals) * self.bin_difs[np.newaxis, :], axis=1))[:, np.newaxis]
-            if vb:
-                plots.plot_ivals(vals, self.info, self.plot_dir, prepend=self.add_text)
-                canvas = plots.set_up_burn_in_plots(self.n_bins, self.n_walkers)
-            full_chain = np.array([[vals[w]] for w in range(self.n_walkers)])
+                self.burn_ins = 0
+                if n_burned == 0:
+                    self.burning_in = False
+                else:
+                    self.burning_in = True
+                vals = ivals
+                vals -= u.safe_log(np.sum(np.exp(ivals) * self.bin_difs[np.newaxis, :], axis=1))[:, np.newaxis]
+                if vb:
+                    plots.plot_ivals(vals, self.info, self.plot_dir, prepend=self.add_text)
+                    canvas = plots.set_up_burn_in_plots(self.n_bins, self.n_walkers)
+                self.chain_buffer = iu.chain_buffer(self.n_walkers, self.n_bins, capacity=1 + 10**n_burned + 10**n_accepted, loc=chain_loc)
+                self.chain_store = iu.chain_store(os.path.join(self.res_dir, 'chains'), compress=True, mode='w')
+                self.chain_buffer.append(vals)
+                self.gr_monitor = s.gr_monitor()
+                self.gr_monitor.update(self.chain_buffer.view())
             while self.burning_in:
                 if vb:
                     print('beginning sampling '+str(self.burn_ins))
-                burn_in_mcmc_outputs = self.sample(vals, 10**n_burned)
+                burn_in_mcmc_outputs = self.sample(vals, 10**n_burned, chain_buffer=self.chain_buffer)
                 chain = burn_in_mcmc_outputs['chains']
                 burn_in_mcmc_outputs['chains'] -= u.safe_log(np.sum(np.exp(chain) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
-                with open(os.path.join(self.res_dir, 'mcmc'+str(self.burn_ins)+'.p'), 'wb') as file_location:
-                    cpkl.dump(burn_in_mcmc_outputs, file_location)
-                full_chain = np.concatenate((full_chain, burn_in_mcmc_outputs['chains']), axis=1)
+                self.chain_store.append({'chains': burn_in_mcmc_outputs['chains'], 'probs': burn_in_mcmc_outputs['probs']})
+                self.gr_monitor.update(burn_in_mcmc_outputs['chains'])
+                self.burning_in = self.gr_monitor.test(gr_threshold)
                 if vb:
-                    canvas = plots.plot_sampler_progress(canvas, burn_in_mcmc_outputs, full_chain, self.burn_ins, self.plot_dir, prepend=self.add_text)
-                self.burning_in = s.gr_test(full_chain, gr_threshold)
+                    canvas = plots.plot_sampler_progress(canvas, burn_in_mcmc_outputs, self.gr_monitor.history[-1], self.burn_ins, self.plot_dir, prepend=self.add_text)
+                if self.burning_in and _out_of_budget():
+                    if vb:
+                        print('ending burn-in before convergence because the sampling budget is spent')
+                    self.burning_in = False
                 vals = np.array([item[-1] for item in burn_in_mcmc_outputs['chains']])
                 self.burn_ins += 1
-
-            mcmc_outputs = self.sample(vals, 10**n_accepted)
-            chain = mcmc_outputs['chains']
-            mcmc_outputs['chains'] -= u.safe_log(np.sum(np.exp(chain) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
-            full_chain = np.concatenate((full_chain, mcmc_outputs['chains']), axis=1)
-            with open(os.path.join(self.res_dir, 'full_chain.p'), 'wb') as file_location:
-                cpkl.dump(full_chain, file_location)
+                if checkpoint is not None:
+                    self.write_checkpoint(checkpoint, vals, vb=vb)
+
+            if n_eff is None:
+                mcmc_outputs = self.sample(vals, 10**n_accepted, chain_buffer=self.chain_buffer)
+                chain = mcmc_outputs['chains']
+                mcmc_outputs['chains'] -= u.safe_log(np.sum(np.exp(chain) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
+                self.chain_store.append({'chains': mcmc_outputs['chains'], 'probs': mcmc_outputs['probs']})
+                chain_start = self.chain_store.n_steps() - 10**n_accepted
+            else:
+                n_start = self.chain_buffer.n_steps
+                chain_start = self.chain_store.n_steps()
+                blocks = []
+                taus = None
+                while True:
+                    block_mcmc_outputs = self.sample(vals, 10**n_burned, chain_buffer=self.chain_buffer)
+                    chain = block_mcmc_outputs['chains']
+                    block_mcmc_outputs['chains'] -= u.safe_log(np.sum(np.exp(chain) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
+                    self.chain_store.append({'chains': block_mcmc_outputs['chains'], 'probs': block_mcmc_outputs['probs']})
+                    blocks.append(block_mcmc_outputs)
+                    vals = np.array([item[-1] for item in block_mcmc_outputs['chains']])
+                    chains = self.chain_buffer.view(n_start)
+                    old_taus = taus
+                    taus = s.acors(chains)
+                    n_effs = self.n_walkers * chains.shape[1] / taus
+                    if vb:
+                        print('effective number of samples = '+str(n_effs))
+                    settled = old_taus is not None and np.all(np.abs(taus - old_taus) <= d.acor_tol * taus)
+                    if settled and np.min(n_effs) >= n_eff:
+                        stop_reason = 'n_eff'
+                        break
+                    if _out_of_budget():
+                        if vb:
+                            print('ending sampling before reaching the effective number of samples because the sampling budget is spent')
+                        stop_reason = 'budget'
+                        break
+                mcmc_outputs = {}
+                mcmc_outputs['chains'] = chains
+                mcmc_outputs['probs'] = np.concatenate([block['probs'] for block in blocks], axis=1)
+                mcmc_outputs['fracs'] = np.mean([block['fracs'] for block in blocks], axis=0)
+                mcmc_outputs['acors'] = taus
+                mcmc_outputs['n_eff'] = n_effs
+                mcmc_outputs['stop_reason'] = stop_reason
+            evaluator.close()
 
             self.log_smp_nz = mcmc_outputs['chains']
             self.smp_nz = np.exp(self.log_smp_nz)
-            self.info['log_sampled_nz_meta_data'] = mcmc_outputs
+            self.info['log_sampled_nz_meta_data'] = self.sampled_meta_data(mcmc_outputs, chain_start=chain_start)
             self.log_bfe_nz = s.norm_fit(self.log_smp_nz)[0]
             self.bfe_nz = np.exp(self.log_bfe_nz)
             self.info['estimators']['log_mean_sampled_nz'] = self.log_bfe_nz
         else:
-            self.log_smp_nz = self.info['log_sampled_nz_meta_data']
+            self.log_smp_nz = iu.read_samples(self.info['log_sampled_nz_meta_data'])
             self.smp_nz = np.exp(self.log_smp_nz)
             self.log_bfe_nz = self.info['estimators']['log_mean_sampled_nz']
-            self.bfe_nz = np.exp(self.log_smp_nz)
+            self.bfe_nz = np.exp(self.log_bfe_nz)
 
         # if vb:
             # plots.plot_samples(self.info, self.plot_dir)
 
         return self.log_smp_nz
 
+    def calculate_nuts_samples(self, ivals, n_accepted=d.n_accepted, n_burned=d.n_burned, vb=True, no_data=0, no_prior=0, target_accept=d.nuts_target_accept, max_depth=d.nuts_max_depth):
+        """
+        Calculates samples estimating the redshift density function with the
+        No-U-Turn Sampler, using the gradient of the hyperposterior
+
+        Parameters
+        ----------
+        ivals: numpy.ndarray, float
+            initial values of log n(z) for each chain
+        n_accepted: int, optional
+            log10 number of samples to accept per chain
+        n_burned: int, optional
+            log10 number of warmup steps per chain over which the step size
+            and mass matrix are adapted
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+        no_data: boolean, optional
+            True to exclude data contribution to hyperposterior
+        no_prior: boolean, optional
+            True to exclude prior contribution to hyperposterior
+        target_accept: float, optional
+            mean acceptance statistic sought by step size adaptation
+        max_depth: int, optional
+            maximum depth of the trajectory tree
+
+        Returns
+        -------
+        log_samples_nz: ndarray, float
+            array of sampled log redshift density function bin values
+        """
+        if 'log_mean_sampled_nz' not in self.info['estimators']:
+            if no_data:
+                def _log_prob_and_gradient(log_nz):
+                    return (self.evaluate_log_hyper_prior(log_nz), self.evaluate_log_hyper_prior_gradient(log_nz))
+            elif no_prior:
+                def _log_prob_and_gradient(log_nz):
+                    return (self.evaluate_log_hyper_likelihood(log_nz), self.evaluate_log_hyper_likelihood_gradient(log_nz))
+            else:
+                def _log_prob_and_gradient(log_nz):
+                    return (self.evaluate_log_hyper_posterior(log_nz), self.evaluate_log_hyper_posterior_gradient(log_nz))
+            ivals = np.atleast_2d(ivals)
+            self.n_walkers = len(ivals)
+            start_time = timeit.default_timer()
+            sampler = iu.nuts_sampler(_log_prob_and_gradient, self.n_bins, target_accept=target_accept, max_depth=max_depth)
+            chain_outputs = []
+            for (i, ival) in enumerate(ivals):
+                chain_outputs.append(sampler.run(ival, 10**n_burned, 10**n_accepted))
+                sampler.inv_metric = np.ones(self.n_bins)
+                if vb:
+                    print('chain '+str(i)+' adapted step size '+str(chain_outputs[-1]['step_size'])+' with '+str(np.sum(chain_outputs[-1]['divergences']))+' divergences')
+            chains = np.array([outputs['samples'] for outputs in chain_outputs])
+            chains -= u.safe_log(np.sum(np.exp(chains) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
+            mcmc_outputs = {}
+            mcmc_outputs['chains'] = chains
+            mcmc_outputs['probs'] = np.array([outputs['probs'] for outputs in chain_outputs])
+            mcmc_outputs['fracs'] = np.array([np.mean(outputs['accept_stats']) for outputs in chain_outputs])
+            mcmc_outputs['acors'] = s.acors(chains)
+            mcmc_outputs['n_eff'] = np.prod(chains.shape[:2]) / mcmc_outputs['acors']
+            mcmc_outputs['step_sizes'] = np.array([outputs['step_size'] for outputs in chain_outputs])
+            mcmc_outputs['inv_metrics'] = np.array([outputs['inv_metric'] for outputs in chain_outputs])
+            mcmc_outputs['n_divergences'] = np.array([np.sum(outputs['divergences']) for outputs in chain_outputs])
+            mcmc_outputs['tree_depths'] = np.array([outputs['depths'] for outputs in chain_outputs])
+            mcmc_outputs['n_gradient_evals'] = np.sum([np.sum(outputs['n_steps']) for outputs in chain_outputs])
+            mcmc_outputs['wall_time'] = timeit.default_timer() - start_time
+            self.chain_store = iu.chain_store(os.path.join(self.res_dir, 'chains'), compress=True, mode='w')
+            self.chain_store.append({'chains': mcmc_outputs['chains'], 'probs': mcmc_outputs['probs']})
+            if vb:
+                print('effective number of samples = '+str(mcmc_outputs['n_eff'])+' from '+str(mcmc_outputs['n_gradient_evals'])+' sampling gradient evaluations')
+
+            self.log_smp_nz = mcmc_outputs['chains']
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.info['log_sampled_nz_meta_data'] = self.sampled_meta_data(mcmc_outputs)
+            self.log_bfe_nz = s.norm_fit(self.log_smp_nz)[0]
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+            self.info['estimators']['log_mean_sampled_nz'] = self.log_bfe_nz
+        else:
+            self.log_smp_nz = iu.read_samples(self.info['log_sampled_nz_meta_data'])
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.log_bfe_nz = self.info['estimators']['log_mean_sampled_nz']
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+
+        return self.log_smp_nz
+
+    def calculate_gibbs_samples(self, ivals, n_accepted=d.n_accepted, n_burned=d.n_burned, alpha=1., vb=True):
+        """
+        Calculates samples estimating the redshift density function by Gibbs
+        sampling, alternately drawing the bin of every galaxy and the
+        normalized n(z) from its Dirichlet conditional
+
+        Parameters
+        ----------
+        ivals: numpy.ndarray, float
+            initial values of log n(z) for each chain
+        n_accepted: int, optional
+            log10 number of sweeps to accept per chain
+        n_burned: int, optional
+            log10 number of sweeps to discard per chain
+        alpha: float or numpy.ndarray, float, optional
+            concentration of the Dirichlet hyperprior on the fraction of
+            galaxies in each bin, defaults to flat
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+
+        Returns
+        -------
+        log_samples_nz: ndarray, float
+            array of sampled log redshift density function bin values
+
+        Notes
+        -----
+        The Dirichlet hyperprior takes the place of the hyperprior of this
+        object, which is not conjugate to the bin counts.  All chains share
+        each pass over the catalog.
+        """
+        if 'log_mean_sampled_nz' not in self.info['estimators']:
+            ivals = np.atleast_2d(ivals)
+            self.n_walkers = len(ivals)
+            alpha = alpha * np.ones(self.n_bins)
+            start_time = timeit.default_timer()
+            nz = np.exp(ivals)
+            fracs = nz * self.bin_difs[np.newaxis, :]
+            fracs /= np.sum(fracs, axis=1)[:, np.newaxis]
+            n_burned = 10**n_burned
+            n_accepted = 10**n_accepted
+            chains = np.empty((self.n_walkers, n_accepted, self.n_bins))
+            all_counts = np.empty((self.n_walkers, n_accepted, self.n_bins), dtype=int)
+            for i in range(n_burned + n_accepted):
+                counts = self.sample_bin_counts(fracs / self.bin_difs[np.newaxis, :])
+                fracs = np.array([np.random.dirichlet(alpha + chain_counts) for chain_counts in counts])
+                if i >= n_burned:
+                    chains[:, i - n_burned] = u.safe_log(fracs / self.bin_difs[np.newaxis, :])
+                    all_counts[:, i - n_burned] = counts
+                if vb and (i + 1) % n_burned == 0:
+                    print('completed '+str(i + 1)+' Gibbs sweeps')
+            mcmc_outputs = {}
+            mcmc_outputs['chains'] = chains
+            mcmc_outputs['counts'] = all_counts
+            mcmc_outputs['fracs'] = np.ones(self.n_walkers)
+            mcmc_outputs['acors'] = s.acors(chains)
+            mcmc_outputs['n_eff'] = np.prod(chains.shape[:2]) / mcmc_outputs['acors']
+            mcmc_outputs['wall_time'] = timeit.default_timer() - start_time
+            self.chain_store = iu.chain_store(os.path.join(self.res_dir, 'chains'), compress=True, mode='w')
+            self.chain_store.append({'chains': mcmc_outputs['chains'], 'counts': mcmc_outputs['counts']})
+            if vb:
+                print('effective number of samples = '+str(mcmc_outputs['n_eff']))
+
+            self.log_smp_nz = mcmc_outputs['chains']
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.info['log_sampled_nz_meta_data'] = self.sampled_meta_data(mcmc_outputs)
+            self.log_bfe_nz = s.norm_fit(self.log_smp_nz)[0]
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+            self.info['estimators']['log_mean_sampled_nz'] = self.log_bfe_nz
+        else:
+            self.log_smp_nz = iu.read_samples(self.info['log_sampled_nz_meta_data'])
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.log_bfe_nz = self.info['estimators']['log_mean_sampled_nz']
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+
+        return self.log_smp_nz
+
+    def calculate_laplace(self, start, n_samps=10**d.n_accepted, vb=True, no_data=0, no_prior=0, method=d.mmle_method):
+        """
+        Approximates the hyperposterior by a Gaussian in log n(z) about its
+        maximum, with covariance from the Hessian there, and draws
+        pseudo-samples from it
+
+        Parameters
+        ----------
+        start: numpy.ndarray, float
+            array of log redshift density function bin values at which to begin
+            optimizing
+        n_samps: int, optional
+            number of pseudo-samples to draw
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+        no_data: boolean, optional
+            True to exclude data contribution to hyperposterior
+        no_prior: boolean, optional
+            True to exclude prior contribution to hyperposterior
+        method: string, optional
+            optimization method, see log_z_dens.optimize
+
+        Returns
+        -------
+        log_samples_nz: ndarray, float
+            array of pseudo-sampled log redshift density function bin values
+
+        Notes
+        -----
+        Directions in which the curvature is negligible relative to the
+        largest, such as the overall normalization without a hyperprior, are
+        given zero variance.  A ValueError is raised if the curvature is
+        negative in any direction, i.e. if the optimization did not end at a
+        maximum.
+        """
+        if 'log_mean_sampled_nz' not in self.info['estimators']:
+            (mean, cost) = self.optimize(start, no_data=no_data, no_prior=no_prior, method=method, vb=vb)
+            if no_data:
+                component = 'prior'
+            elif no_prior:
+                component = 'likelihood'
+            else:
+                component = 'posterior'
+            hessian = getattr(self, 'evaluate_log_hyper_' + component + '_hessian')(mean)
+            (eigvals, eigvecs) = np.linalg.eigh(-0.5 * (hessian + hessian.T))
+            tol = d.laplace_eig_tol * np.max(np.abs(eigvals))
+            if np.any(eigvals < -tol):
+                raise ValueError('hyper'+component+' is not at a maximum, with curvature eigenvalues '+str(eigvals[eigvals < -tol])+' of the wrong sign')
+            # flat directions, such as the overall normalization without a hyperprior, get no variance
+            kept = eigvals > tol
+            cov = np.dot(eigvecs[:, kept] / eigvals[kept][np.newaxis, :], eigvecs[:, kept].T)
+            cost['approximation'] = 'laplace'
+            self.store_approximate_samples(mean, cov, n_samps, cost)
+        else:
+            self.log_smp_nz = iu.read_samples(self.info['log_sampled_nz_meta_data'])
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.log_bfe_nz = self.info['estimators']['log_mean_sampled_nz']
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+
+        return self.log_smp_nz
+
+    def calculate_variational(self, start, n_samps=10**d.n_accepted, vb=True, no_data=0, no_prior=0, n_iterations=d.vi_n_iterations, n_mc=d.vi_n_mc, learning_rate=d.adam_learning_rate):
+        """
+        Approximates the hyperposterior by the Gaussian in log n(z) maximizing
+        the evidence lower bound, fit by stochastic gradient ascent with
+        reparametrized Monte Carlo gradients, and draws pseudo-samples from it
+
+        Parameters
+        ----------
+        start: numpy.ndarray, float
+            array of log redshift density function bin values at which to
+            center the initial Gaussian
+        n_samps: int, optional
+            number of pseudo-samples to draw
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+        no_data: boolean, optional
+            True to exclude data contribution to hyperposterior
+        no_prior: boolean, optional
+            True to exclude prior contribution to hyperposterior
+        n_iterations: int, optional
+            number of Adam steps
+        n_mc: int, optional
+            number of draws from the Gaussian per gradient estimate
+        learning_rate: float, optional
+            Adam step size
+
+        Returns
+        -------
+        log_samples_nz: ndarray, float
+            array of pseudo-sampled log redshift density function bin values
+
+        Notes
+        -----
+        The Gaussian has a full covariance parametrized by its Cholesky factor
+        with logged diagonal, and the returned fit averages the iterates of
+        the second half of the optimization.
+        """
+        if 'log_mean_sampled_nz' not in self.info['estimators']:
+            if no_data:
+                log_prob_gradient = self.evaluate_log_hyper_prior_gradient
+            elif no_prior:
+                log_prob_gradient = self.evaluate_log_hyper_likelihood_gradient
+            else:
+                log_prob_gradient = self.evaluate_log_hyper_posterior_gradient
+            start_time = timeit.default_timer()
+            lower = np.tril_indices(self.n_bins, -1)
+            mean = np.array(start, dtype=float)
+            log_diag = np.log(d.vi_initial_scale) * np.ones(self.n_bins)
+            off_diag = np.zeros(len(lower[0]))
+            optimizer = iu.adam(learning_rate=learning_rate)
+            n_averaged = 0
+            averages = [0., 0., 0.]
+            for i in range(n_iterations):
+                chol = np.diag(np.exp(log_diag))
+                chol[lower] = off_diag
+                eps = np.random.normal(size=(n_mc, self.n_bins))
+                grads = np.array([log_prob_gradient(mean + np.dot(chol, e)) for e in eps])
+                grad_mean = np.mean(grads, axis=0)
+                grad_chol = np.dot(grads.T, eps) / n_mc
+                grad_log_diag = np.diag(grad_chol) * np.exp(log_diag) + 1.
+                grad_off_diag = grad_chol[lower]
+                params = np.concatenate((mean, log_diag, off_diag))
+                params += optimizer.step(-np.concatenate((grad_mean, grad_log_diag, grad_off_diag)))
+                (mean, log_diag, off_diag) = np.split(params, [self.n_bins, 2 * self.n_bins])
+                if i >= n_iterations // 2:
+                    n_averaged += 1
+                    averages = [average + (param - average) / n_averaged for (average, param) in zip(averages, (mean, log_diag, off_diag))]
+            (mean, log_diag, off_diag) = averages
+            chol = np.diag(np.exp(log_diag))
+            chol[lower] = off_diag
+            cov = np.dot(chol, chol.T)
+            meta = {}
+            meta['approximation'] = 'variational'
+            meta['n_iterations'] = n_iterations
+            meta['n_gradient_evals'] = n_iterations * n_mc
+            meta['wall_time'] = timeit.default_timer() - start_time
+            if vb:
+                print('variational fit used '+str(meta['n_gradient_evals'])+' gradient evaluations in '+str(meta['wall_time'])+' s')
+            self.store_approximate_samples(mean, cov, n_samps, meta)
+        else:
+            self.log_smp_nz = iu.read_samples(self.info['log_sampled_nz_meta_data'])
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.log_bfe_nz = self.info['estimators']['log_mean_sampled_nz']
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+
+        return self.log_smp_nz
+
+    def calculate_sg_samples(self, ivals, n_accepted=d.sg_n_accepted, n_burned=d.sg_n_burned, vb=True, no_prior=0, method='sghmc', batch_size=d.sg_batch_size, step_size=None, friction=d.sg_friction, anchor_every=None, gr_threshold=d.gr_threshold):
+        """
+        Calculates samples estimating the redshift density function by
+        stochastic gradient MCMC on minibatches of galaxies
+
+        Parameters
+        ----------
+        ivals: numpy.ndarray, float
+            initial values of log n(z) for each chain
+        n_accepted: int, optional
+            log10 number of samples to accept per chain
+        n_burned: int, optional
+            log10 number of steps to discard per chain
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+        no_prior: boolean, optional
+            True to exclude prior contribution to hyperposterior
+        method: string, optional
+            'sgld' for stochastic gradient Langevin dynamics (Welling & Teh
+            2011), 'sghmc' for stochastic gradient Hamiltonian Monte Carlo
+            (Chen, Fox & Guestrin 2014)
+        batch_size: int, optional
+            number of galaxies per minibatch
+        step_size: float, optional
+            discretization step, the learning rate for SGHMC, defaults to
+            d.sgld_step_size or d.sghmc_step_size
+        friction: float, optional
+            momentum decay per step for SGHMC
+        anchor_every: int, optional
+            number of steps between whole-catalog control variate
+            evaluations, defaults to none
+        gr_threshold: float, optional
+            split Gelman-Rubin test statistic of the accepted samples above
+            which they are flagged as unconverged
+
+        Returns
+        -------
+        log_samples_nz: ndarray, float
+            array of sampled log redshift density function bin values
+
+        Notes
+        -----
+        The cost of a step is independent of the size of the catalog, apart
+        from any control variate evaluations.  All chains share each
+        minibatch, and the samples carry the discretization bias of a fixed
+        step size.  The samples are appended to a compressed chippr.chain_store
+        in the chains subdirectory of the results directory.
+        """
+        if 'log_mean_sampled_nz' not in self.info['estimators']:
+            if method not in ['sgld', 'sghmc']:
+                raise ValueError('unsupported stochastic gradient sampler ' + str(method))
+            if step_size is None:
+                step_size = getattr(d, method + '_step_size')
+            start_time = timeit.default_timer()
+            vals = np.array(np.atleast_2d(ivals), dtype=float)
+            self.n_walkers = len(vals)
+            n_burned = 10**n_burned
+            n_accepted = 10**n_accepted
+            chains = np.empty((self.n_walkers, n_accepted, self.n_bins))
+            momenta = np.zeros_like(vals)
+            anchors = [None] * self.n_walkers
+            n_passes = 0
+            for i in range(n_burned + n_accepted):
+                if anchor_every is not None and i % anchor_every == 0:
+                    anchors = [self.make_anchor(val) for val in vals]
+                    n_passes += 1
+                batch = np.sort(np.random.randint(self.n_pdfs, size=batch_size))
+                for j in range(self.n_walkers):
+                    grad = self.evaluate_minibatch(vals[j], batch, anchor=anchors[j])[1]
+                    if not no_prior:
+                        grad += self.evaluate_log_hyper_prior_gradient(vals[j])
+                    if method == 'sgld':
+                        vals[j] += 0.5 * step_size * grad + np.sqrt(step_size) * np.random.normal(size=self.n_bins)
+                    else:
+                        momenta[j] = (1. - friction) * momenta[j] + step_size * grad + np.sqrt(2. * friction * step_size) * np.random.normal(size=self.n_bins)
+                        vals[j] += momenta[j]
+                if i >= n_burned:
+                    chains[:, i - n_burned] = vals
+                if vb and (i + 1) % n_burned == 0:
+                    print('completed '+str(i + 1)+' '+method+' steps')
+            chains -= u.safe_log(np.sum(np.exp(chains) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
+            mcmc_outputs = {}
+            mcmc_outputs['chains'] = chains
+            mcmc_outputs['fracs'] = np.ones(self.n_walkers)
+            mcmc_outputs['acors'] = s.acors(chains)
+            mcmc_outputs['n_eff'] = np.prod(chains.shape[:2]) / mcmc_outputs['acors']
+            mcmc_outputs['method'] = method
+            mcmc_outputs['n_galaxies_touched'] = (n_burned + n_accepted) * batch_size
+            mcmc_outputs['n_passes'] = n_passes
+            mcmc_outputs['wall_time'] = timeit.default_timer() - start_time
+            # splitting each chain in half exposes drift as well as disagreement between chains
+            halves = np.concatenate(np.split(chains[:, :2 * (n_accepted // 2)], 2, axis=1))
+            mcmc_outputs['gr_stats'] = np.array([s.single_parameter_gr_stat(halves[:, :, k]) for k in range(self.n_bins)])
+            mcmc_outputs['converged'] = np.max(mcmc_outputs['gr_stats']) <= gr_threshold
+            self.chain_store = iu.chain_store(os.path.join(self.res_dir, 'chains'), compress=True, mode='w')
+            self.chain_store.append({'chains': mcmc_outputs['chains']})
+            if vb:
+                print('effective number of samples = '+str(mcmc_outputs['n_eff']))
+                if not mcmc_outputs['converged']:
+                    print(method+' samples may not have converged, with split Gelman-Rubin statistics up to '+str(np.max(mcmc_outputs['gr_stats']))+'; consider more n_burned steps or a larger step_size')
+
+            self.log_smp_nz = mcmc_outputs['chains']
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.info['log_sampled_nz_meta_data'] = self.sampled_meta_data(mcmc_outputs)
+            self.log_bfe_nz = s.norm_fit(self.log_smp_nz)[0]
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+            self.info['estimators']['log_mean_sampled_nz'] = self.log_bfe_nz
+        else:
+            self.log_smp_nz = iu.read_samples(self.info['log_sampled_nz_meta_data'])
+            self.smp_nz = np.exp(self.log_smp_nz)
+            self.log_bfe_nz = self.info['estimators']['log_mean_sampled_nz']
+            self.bfe_nz = np.exp(self.log_bfe_nz)
+
+        return self.log_smp_nz
+
+    def sampled_meta_data(self, outputs, chain_start=0):
+        """
+        Function to prepare sampler output for the information dictionary,
+        pointing to the accepted samples in the chain store rather than
+        holding them, so that writing and reading the dictionary stays cheap
+
+        Parameters
+        ----------
+        outputs: dict
+            sampler output including the accepted samples as chains
+        chain_start: int, optional
+            step of the chain store at which the accepted samples begin
+
+        Returns
+        -------
+        meta: dict
+            sampler output without the fields kept in the chain store, with
+            the location of the store and the first step and shape of the
+            accepted samples, for chippr.inf_utils.read_samples
+        """
+        meta = dict((key, outputs[key]) for key in outputs if key not in self.chain_store.index['fields'])
+        meta['chain_loc'] = self.chain_store.loc
+        meta['chain_start'] = chain_start
+        meta['chain_shape'] = np.shape(outputs['chains'])
+        return meta
+
+    def store_approximate_samples(self, mean, cov, n_samps, meta):
+        """
+        Draws normalized pseudo-samples from a Gaussian approximation to the
+        hyperposterior and records them in place of MCMC samples, so that
+        plotting and comparison treat them alike
+
+        Parameters
+        ----------
+        mean: numpy.ndarray, float
+            mean of the Gaussian in log n(z)
+        cov: numpy.ndarray, float
+            covariance of the Gaussian in log n(z)
+        n_samps: int
+            number of pseudo-samples to draw
+        meta: dict
+            details of the approximation to keep with the samples
+
+        Notes
+        -----
+        The pseudo-samples are written to a compressed chippr.chain_store in
+        the chains subdirectory of the results directory.
+        """
+        chains = np.random.multivariate_normal(mean, cov, size=n_samps)[np.newaxis, :, :]
+        chains -= u.safe_log(np.sum(np.exp(chains) * self.bin_difs[np.newaxis, np.newaxis, :], axis=2))[:, :, np.newaxis]
+        meta['chains'] = chains
+        meta['mean'] = mean
+        meta['cov'] = cov
+        self.chain_store = iu.chain_store(os.path.join(self.res_dir, 'chains'), compress=True, mode='w')
+        self.chain_store.append({'chains': chains})
+        self.log_smp_nz = chains
+        self.smp_nz = np.exp(self.log_smp_nz)
+        self.info['log_sampled_nz_meta_data'] = self.sampled_meta_data(meta)
+        self.log_bfe_nz = s.norm_fit(self.log_smp_nz)[0]
+        self.bfe_nz = np.exp(self.log_bfe_nz)
+        self.info['estimators']['log_mean_sampled_nz'] = self.log_bfe_nz
+        return
+
+    def write_checkpoint(self, loc, vals, vb=True):
+        """
+        Saves the state of the sampler between burn-in blocks
+
+        Parameters
+        ----------
+        loc: string
+            file name of the checkpoint
+        vals: numpy.ndarray, float
+            current values of log n(z) for each walker
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+
+        Notes
+        -----
+        The checkpoint is written to a temporary file that then replaces the
+        previous one, so an interruption never leaves a partial checkpoint.
+        The chain itself is not copied into the checkpoint, which records only
+        how many steps of the memory-mapped chain have been flushed.
+        """
+        if self.chain_buffer.loc is None:
+            raise ValueError('checkpointing requires a memory-mapped chain')
+        self.chain_buffer.flush()
+        state = {}
+        state['vals'] = vals
+        state['random_state'] = self.sampler.random_state
+        state['burn_ins'] = self.burn_ins
+        state['burning_in'] = self.burning_in
+        state['gr_monitor'] = self.gr_monitor
+        state['n_steps'] = self.chain_buffer.n_steps
+        # relative to the results directory so that it can be moved
+        state['chain_loc'] = os.path.relpath(self.chain_buffer.loc, self.res_dir)
+        with open(loc + '.tmp', 'wb') as file_location:
+            cpkl.dump(state, file_location)
+        os.rename(loc + '.tmp', loc)
+        if vb:
+            print('saved checkpoint after '+str(self.burn_ins)+' burn-in blocks to '+loc)
+        return
+
+    def read_checkpoint(self, loc, capacity=1, vb=True):
+        """
+        Restores the state of the sampler from a checkpoint
+
+        Parameters
+        ----------
+        loc: string
+            file name of the checkpoint
+        capacity: int, optional
+            number of steps beyond those already sampled for which to allocate
+            space in the chain
+        vb: boolean, optional
+            True to print progress messages to stdout, False to suppress
+
+        Returns
+        -------
+        vals: numpy.ndarray, float
+            values of log n(z) for each walker from which to continue
+        """
+        with open(loc, 'rb') as file_location:
+            state = cpkl.load(file_location)
+        vals = state['vals']
+        if np.shape(vals) != (self.n_walkers, self.n_bins):
+            raise ValueError('checkpoint '+loc+' holds '+str(np.shape(vals))+' walker values but '+str((self.n_walkers, self.n_bins))+' were requested')
+        self.sampler.random_state = state['random_state']
+        self.burn_ins = state['burn_ins']
+        self.burning_in = state['burning_in']
+        self.gr_monitor = state['gr_monitor']
+        n_steps = state['n_steps']
+        self.chain_buffer = iu.chain_buffer(self.n_walkers, self.n_bins, capacity=n_steps + capacity, loc=os.path.join(self.res_dir, state['chain_loc']), n_steps=n_steps)
+        if vb:
+            print('resuming from checkpoint after '+str(self.burn_ins)+' burn-in blocks from '+loc)
+        return vals
+
     def compare(self, vb=True):
         """
         Calculates all available goodness of fit measures
@@ -12,6 +12,7 @@ from chippr import defaults as d
 from chippr import utils as u
 from chippr import plot_utils as pu
 from chippr import stat_utils as s
+from chippr import inf_utils as iu
 
 # defining some shared variables
 
@@ -146,7 +147,7 @@ def set_up_burn_in_plots(n_bins, n_walkers):
 
     return plot_information
 
-def plot_sampler_progress(plot_information, sampler_output, full_chain, burn_ins, plot_dir, prepend=''):
+def plot_sampler_progress(plot_information, sampler_output, gelman_rubin, burn_ins, plot_dir, prepend=''):
     """
     Plots new information into burn-in progress plots
 
@@ -160,8 +161,9 @@ def plot_sampler_progress(plot_information, sampler_output, full_chain, burn_ins
         dictionary containing array of sampled redshift density function bin
         values as well as posterior probabilities, acceptance fractions, and
         autocorrelation times
-    full_chain: ndarray, float
-        array of all accepted samples so far
+    gelman_rubin: ndarray, float
+        Gelman-Rubin test statistic of each bin after the latest block, as
+        recorded by chippr.stat_utils.gr_monitor
     burn_ins: int
         number of between-convergence-check intervals that have already been
         performed
@@ -185,7 +187,6 @@ def plot_sampler_progress(plot_information, sampler_output, full_chain, burn_ins
     (gelman_rubin_evolution_plot, autocorrelation_times_plot, acceptance_fractions_plot, posterior_probabilities_plot, chain_evolution_plot) = plot_information
 
     [f_gelman_rubin_evolution, sps_gelman_rubin_evolution] = gelman_rubin_evolution_plot
-    gelman_rubin = s.multi_parameter_gr_stat(full_chain)
     x_some = [(burn_ins + 1) * n_burn_test] * n_bins
     sps_gelman_rubin_evolution.scatter(x_some,
                            gelman_rubin,
@@ -198,7 +199,7 @@ def plot_sampler_progress(plot_information, sampler_output, full_chain, burn_ins
     f_gelman_rubin_evolution.savefig(os.path.join(plot_dir, prepend+'gelman_rubin_evolution.png'), bbox_inches='tight', pad_inches = 0)
 
     [f_autocorrelation_times, sps_autocorrelation_times] = autocorrelation_times_plot
-    autocorrelation_times = s.acors(full_chain)# sampler_output['acors']
+    autocorrelation_times = sampler_output['acors']
     # default to bins mode for autocorrelation times, will need to fix this later
     # if something == 'bins':
     x_some = [(burn_ins + 1) * n_burn_test] * n_bins
@@ -264,6 +265,28 @@ def plot_sampler_progress(plot_information, sampler_output, full_chain, burn_ins
 
     return plot_information
 
+def norm_fit_samples(meta):
+    """
+    Calculates the mean and standard deviation of the accepted samples in
+    each bin, reading one bin at a time from the chain store
+
+    Parameters
+    ----------
+    meta: dict
+        sampler meta data from a log_z_dens object
+
+    Returns
+    -------
+    norm_stats: tuple, numpy.ndarray, float
+        means and standard deviations of the samples in each bin
+    """
+    n_bins = meta['chain_shape'][-1]
+    stats = [s.norm_fit(iu.read_samples(meta, bins=[k])) for k in range(n_bins)]
+    locs = np.array([stat[0][0] for stat in stats])
+    scales = np.array([stat[1][0] for stat in stats])
+    norm_stats = (locs, scales)
+    return norm_stats
+
 def make_err_txt(info, key):
     # rms = "{0:.3e}".format(info['stats']['rms']['true_nz'+ '__' + key[4:]])
     kld = "{0:.3e}".format(info['stats']['kld'][key])
@@ -432,7 +455,7 @@ def plot_estimators(info, plot_dir, log=True, prepend='', metrics=True, mini=Tru
 
     if 'log_mean_sampled_nz' in info['estimators']:
         # plot_samples(info, plot_dir)
-        (locs, scales) = s.norm_fit(info['log_sampled_nz_meta_data']['chains'])
+        (locs, scales) = norm_fit_samples(info['log_sampled_nz_meta_data'])
         # bfe, =
         # pu.plot_step(sps_log, info['bin_ends'],
         #                 info['estimators']['log_mean_sampled_nz'],
@@ -546,18 +569,17 @@ def plot_samples(info, plot_dir, prepend=''):
         sps.plot(info['truth']['z_grid'], info['truth']['nz_grid'], linewidth=w_tru, alpha=a_tru, color=c_tru, label=l_tru+nz)
         sps_log.plot(info['truth']['z_grid'], u.safe_log(info['truth']['nz_grid']), linewidth=w_tru, alpha=a_tru, color=c_tru, label=l_tru+lnz)
 
-    (locs, scales) = s.norm_fit(info['log_sampled_nz_meta_data']['chains'])
+    (locs, scales) = norm_fit_samples(info['log_sampled_nz_meta_data'])
     for k in range(len(info['bin_ends'])-1):
         x_errs = [info['bin_ends'][k], info['bin_ends'][k], info['bin_ends'][k+1], info['bin_ends'][k+1]]
         log_y_errs = [locs[k] - scales[k], locs[k] + scales[k], locs[k] + scales[k], locs[k] - scales[k]]
         sps_log.fill(x_errs, log_y_errs, color='k', alpha=0.1, linewidth=0.)
         sps.fill(x_errs, np.exp(log_y_errs), color='k', alpha=0.1, linewidth=0.)
-    shape = np.shape(info['log_sampled_nz_meta_data']['chains'])
-    flat = info['log_sampled_nz_meta_data']['chains'].reshape(np.prod(shape[:-1]), shape[-1])
-    random_samples = [np.random.randint(0, len(flat)) for i in range(d.plot_colors)]
+    (n_walkers, n_steps, n_bins) = info['log_sampled_nz_meta_data']['chain_shape']
+    random_samples = [iu.read_samples(info['log_sampled_nz_meta_data'], steps=[np.random.randint(0, n_steps)], walkers=[np.random.randint(0, n_walkers)])[0, 0] for i in range(d.plot_colors)]
     for i in range(d.plot_colors):
-        pu.plot_step(sps_log, info['bin_ends'], flat[random_samples[i]], s=s_smp, d=d_smp, w=w_smp, a=1., c=pu.colors[i])
-        pu.plot_step(sps, info['bin_ends'], np.exp(flat[random_samples[i]]), s=s_smp, d=d_smp, w=w_smp, a=1., c=pu.colors[i])
+        pu.plot_step(sps_log, info['bin_ends'], random_samples[i], s=s_smp, d=d_smp, w=w_smp, a=1., c=pu.colors[i])
+        pu.plot_step(sps, info['bin_ends'], np.exp(random_samples[i]), s=s_smp, d=d_smp, w=w_smp, a=1., c=pu.colors[i])
     pu.plot_step(sps_log, info['bin_ends'], locs, s=s_smp, d=d_smp, w=2., a=1., c='k', l=l_bfe+lnz)
     pu.plot_step(sps, info['bin_ends'], np.exp(locs), s=s_smp, d=d_smp, w=2., a=1., c='k', l=l_bfe+nz)
 
@@ -103,6 +103,61 @@ class mvn(object):
         ps = self.dist.probability(zs)
         return ps
 
+    def evaluate_log(self, zs):
+        """
+        Function to evaluate the log of the multivariate Gaussian probability
+        distribution without underflow far from the mean
+
+        Parameters
+        ----------
+        zs: ndarray, float
+            input vector or vectors at which to evaluate log probability
+
+        Returns
+        -------
+        log_ps: float or ndarray, float
+            output log probability or probabilities
+        """
+        log_ps = self.dist.log_probability(zs)
+        return log_ps
+
+    def evaluate_log_gradient(self, zs):
+        """
+        Function to evaluate the gradient of the log of the multivariate
+        Gaussian probability distribution
+
+        Parameters
+        ----------
+        zs: ndarray, float
+            input vector or (n_points, dim) vectors at which to evaluate
+            gradient
+
+        Returns
+        -------
+        grads: ndarray, float
+            gradient of log probability with respect to each input vector
+        """
+        grads = -1. * np.dot(zs - self.mean, self.invvar)
+        return grads
+
+    def evaluate_log_hessian(self, z):
+        """
+        Function to evaluate the Hessian of the log of the multivariate
+        Gaussian probability distribution, which is independent of position
+
+        Parameters
+        ----------
+        z: numpy.ndarray, float
+            input vector at which to evaluate Hessian
+
+        Returns
+        -------
+        hess: numpy.ndarray, float
+            (dim, dim) matrix of second derivatives of log probability
+        """
+        hess = -1. * self.invvar
+        return hess
+
     def sample_one(self):
         """
         Function to take one sample from multivariate Gaussian probability
@@ -25,3 +25,90 @@ def choice(weights):
     x = np.random.random()
     index = bisect.bisect(cdf_vals, x)
     return index
+
+def make_alias(weights):
+    """
+    Function building the alias table with which to sample a discrete
+    distribution in constant time per draw
+
+    Parameters
+    ----------
+    weights: numpy.ndarray
+        relative probabilities for each category
+
+    Returns
+    -------
+    probs: numpy.ndarray, float
+        probability of keeping each category when it is drawn uniformly
+    aliases: numpy.ndarray, int
+        category to take instead when it is not kept
+
+    Notes
+    -----
+    Uses Vose's method
+    """
+    n_cats = len(weights)
+    scaled = n_cats * np.asarray(weights, dtype=float) / np.sum(weights)
+    probs = np.ones(n_cats)
+    aliases = np.arange(n_cats)
+    small = [k for k in range(n_cats) if scaled[k] < 1.]
+    large = [k for k in range(n_cats) if scaled[k] >= 1.]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        probs[s] = scaled[s]
+        aliases[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.
+        if scaled[l] < 1.:
+            small.append(l)
+        else:
+            large.append(l)
+    return (probs, aliases)
+
+def alias_choice(probs, aliases, n_samps, random_state=np.random):
+    """
+    Function sampling discrete distribution many times from its alias table
+
+    Parameters
+    ----------
+    probs: numpy.ndarray, float
+        probability of keeping each category, from make_alias
+    aliases: numpy.ndarray, int
+        category to take instead of each, from make_alias
+    n_samps: int
+        number of samples to take
+    random_state: numpy.random.RandomState object, optional
+        source of random numbers, defaults to the global random state
+
+    Returns
+    -------
+    indices: numpy.ndarray, int
+        chosen categories
+    """
+    x = random_state.random_sample(n_samps) * len(probs)
+    indices = x.astype(int)
+    x -= indices
+    indices = np.where(x < probs[indices], indices, aliases[indices])
+    return indices
+
+def chunk_seed(root_seed, index):
+    """
+    Function deriving the seed of an independent random stream for one chunk
+    of a simulation from a root seed, so that each chunk's draws depend only
+    on the root seed and the chunk's position, not on which worker makes it
+
+    Parameters
+    ----------
+    root_seed: int
+        seed of the whole simulation
+    index: int
+        position of the chunk
+
+    Returns
+    -------
+    seed: numpy.ndarray, int
+        key with which to seed a numpy.random.RandomState, whose Mersenne Twister
+        initialization by array scrambles distinct keys into uncorrelated
+        states
+    """
+    seed = np.array([root_seed, index], dtype=np.uint32)
+    return seed
@@ -181,94 +181,175 @@ def gr_test(sample, threshold=d.gr_threshold):
     test_result = np.max(gr) > threshold
     return test_result
 
-def cft(xtimes, lag):#xtimes has ntimes elements
+class gr_monitor(object):
+
+    def __init__(self, discard=0.5):
+        """
+        Object accumulating per-walker running moments of MCMC chains block by
+        block to evaluate the Gelman-Rubin statistic without revisiting old
+        samples
+
+        Parameters
+        ----------
+        discard: float, optional
+            fraction of the chain at the start to exclude from the statistic,
+            rounded to whole blocks
+        """
+        self.discard = discard
+        self.blocks = []
+        self.history = []
+
+    def update(self, sample):
+        """
+        Function to add a block of samples to the running moments
+
+        Parameters
+        ----------
+        sample: numpy.ndarray, float
+            new samples of dimensions (n_walkers, n_iterations, n_params)
+        """
+        sample = np.asarray(sample)
+        n = sample.shape[1]
+        means = np.mean(sample, axis=1)
+        m2s = np.sum((sample - means[:, np.newaxis, :]) ** 2, axis=1)
+        self.blocks.append((n, means, m2s))
+        return
+
+    def combine(self, blocks):
+        """
+        Function to merge running moments of consecutive blocks (Chan, Golub &
+        LeVeque 1983)
+
+        Parameters
+        ----------
+        blocks: list, tuple
+            number of iterations, per-walker means, and per-walker sums of
+            squared deviations of each block
+
+        Returns
+        -------
+        moments: tuple
+            number of iterations, per-walker means, and per-walker sums of
+            squared deviations over all blocks
+        """
+        (n, means, m2s) = blocks[0]
+        for (n_b, means_b, m2s_b) in blocks[1:]:
+            n_ab = n + n_b
+            delta = means_b - means
+            means = means + delta * float(n_b) / n_ab
+            m2s = m2s + m2s_b + delta ** 2 * float(n) * n_b / n_ab
+            n = n_ab
+        moments = (n, means, m2s)
+        return moments
+
+    def gr_stat(self):
+        """
+        Calculates the Gelman-Rubin test statistic over the retained window of
+        blocks
+
+        Returns
+        -------
+        Rs: numpy.ndarray, float
+            vector of the potential scale reduction factors
+        """
+        lengths = np.array([block[0] for block in self.blocks])
+        kept = np.cumsum(lengths[::-1]) <= (1. - self.discard) * np.sum(lengths)
+        n_kept = max(1, np.sum(kept))
+        (n, means, m2s) = self.combine(self.blocks[-n_kept:])
+        m = means.shape[0]
+        W = np.mean(m2s / (n - 1.), axis=0)
+        xbb = np.mean(means, axis=0)
+        B = n / (m - 1.) * np.sum((xbb - means) ** 2., axis=0)
+        var_x = (n - 1.) / n * W + 1. / n * B
+        Rs = np.sqrt(var_x / W)
+        return Rs
+
+    def test(self, threshold=d.gr_threshold):
+        """
+        Performs the Gelman-Rubin test of convergence on the samples so far
+
+        Parameters
+        ----------
+        threshold: float, optional
+            Gelman-Rubin test statistic criterion (usually around 1)
+
+        Returns
+        -------
+        test_result: boolean
+            True if burning in, False if post-burn in
+        """
+        gr = self.gr_stat()
+        self.history.append(gr)
+        print('Gelman-Rubin test statistic = '+str(gr))
+        test_result = np.max(gr) > threshold
+        return test_result
+
+def autocorrelation(x):
     """
-    Helper function to calculate autocorrelation time for chain of MCMC samples
-
-    Parameters
-    ----------
-    xtimes: numpy.ndarray, float
-        single parameter values for a single walker over all iterations
-    lag: int
-        maximum lag time in number of iterations
-
-    Returns
-    -------
-    ans: numpy.ndarray, float
-        autocorrelation time for one time lag for one parameter of one walker
-    """
-    lent = len(xtimes) - lag
-    allt = xrange(lent)
-    ans = np.array([xtimes[t+lag] * xtimes[t] for t in allt])
-    return ans
-
-def cf(xtimes):#xtimes has ntimes elements
-    """
-    Helper function to calculate autocorrelation time for chain of MCMC samples
-
-    Parameters
-    ----------
-    xtimes: numpy.ndarray, float
-        single parameter values for a single walker over all iterations
-
-    Returns
-    -------
-    cf: numpy.ndarray, float
-        autocorrelation time over all time lags for one parameter of one walker
-    """
-    cf0 = np.dot(xtimes, xtimes)
-    allt = xrange(len(xtimes) / 2)
-    cf = np.array([sum(cft(xtimes,lag)[len(xtimes) / 2:]) for lag in allt]) / cf0
-    return cf
-
-def cfs(x, mode):#xbinstimes has nbins by ntimes elements
-    """
-    Helper function for calculating autocorrelation time for MCMC chains
+    Calculates the normalized autocorrelation function of chains of MCMC
+    samples by fast Fourier transform
 
     Parameters
     ----------
     x: numpy.ndarray, float
-        input parameter values of length number of iterations by number of
-        walkers if mode='walkers' or dimension of parameters if mode='bins'
-    mode: string
-        'bins' for one autocorrelation time per parameter, 'walkers' for one
-        autocorrelation time per walker
+        chains of parameter values with iterations along the last axis
 
     Returns
     -------
-    cfs: numpy.ndarray, float
-        autocorrelation times for all walkers if mode='walkers' or all
-        parameters if mode='bins'
+    acf: numpy.ndarray, float
+        autocorrelation function at all time lags, of the same shape as x
     """
-    if mode == 'walkers':
-        xbinstimes = x
-        cfs = np.array([sum(cf(xtimes)) for xtimes in xbinstimes]) / len(xbinstimes)
-    if mode == 'bins':
-        xwalkerstimes = x
-        cfs = np.array([sum(cf(xtimes)) for xtimes in xwalkerstimes]) / len(xwalkerstimes)
-    return cfs
-
-def acors(xtimeswalkersbins, mode='bins'):
+    x = np.asarray(x)
+    n = x.shape[-1]
+    n_fft = 2 ** int(np.ceil(np.log2(2 * n)))
+    centered = x - np.mean(x, axis=-1)[..., np.newaxis]
+    transform = np.fft.rfft(centered, n=n_fft, axis=-1)
+    acf = np.fft.irfft(transform * np.conjugate(transform), n=n_fft, axis=-1)[..., :n]
+    variance = acf[..., :1].copy()
+    # chains that never moved are treated as uncorrelated rather than undefined
+    acf[..., 1:][np.broadcast_to(variance <= 0., acf[..., 1:].shape)] = 0.
+    variance[variance <= 0.] = 1.
+    acf /= variance
+    acf[..., 0] = 1.
+    return acf
+
+def acors(xwalkerstimesbins, mode='bins', window=d.acor_window):
     """
-    Calculates autocorrelation time for MCMC chains
+    Calculates integrated autocorrelation time for MCMC chains, with the
+    self-consistent window of Sokal (1997)
 
     Parameters
     ----------
-    xtimeswalkersbins: numpy.ndarray, float
-        emcee chain values of dimensions (n_iterations, n_walkers, n_parameters)
+    xwalkerstimesbins: numpy.ndarray, float
+        emcee chain values of dimensions (n_walkers, n_iterations,
+        n_parameters)
     mode: string, optional
-        'bins' for one autocorrelation time per parameter, 'walkers' for one
-        autocorrelation time per walker
+        'bins' for one autocorrelation time per parameter, averaging the
+        autocorrelation function over walkers weighted by their variances,
+        'walkers' for one autocorrelation time per walker, averaging over
+        parameters
+    window: float, optional
+        smallest ratio of summation window to autocorrelation time
 
     Returns
     -------
     taus: numpy.ndarray, float
         autocorrelation times by bin or by walker depending on mode
     """
+    xwalkersbinstimes = np.swapaxes(xwalkerstimesbins, 1, 2)
+    acf = autocorrelation(xwalkersbinstimes)
     if mode == 'walkers':
-        xwalkersbinstimes = np.swapaxes(xtimeswalkersbins, 1, 2)#nwalkers by nbins by nsteps
-        taus = np.array([1. + 2. * sum(cfs(xbinstimes, mode)) for xbinstimes in xwalkersbinstimes])#/len(xwalkersbinstimes)# 1+2*sum(...)
+        rho = np.mean(acf, axis=1)
     if mode == 'bins':
-        xbinswalkerstimes = xtimeswalkersbins.T#nbins by nwalkers by nsteps
-        taus = np.array([1. + 2. * sum(cfs(xwalkerstimes, mode)) for xwalkerstimes in xbinswalkerstimes])#/len(xwalkersbinstimes)# 1+2*sum(...)
+        # weighting by variance pools the autocovariances, so stuck walkers do not pass for uncorrelated ones
+        weights = np.var(xwalkersbinstimes, axis=-1)
+        totals = np.sum(weights, axis=0)
+        weights = np.where(totals > 0., weights / np.where(totals > 0., totals, 1.), 1. / len(weights))
+        rho = np.sum(weights[:, :, np.newaxis] * acf, axis=0)
+    # tau(M) = 1 + 2 * sum of rho over lags 1 through M
+    cumulative_taus = 2. * np.cumsum(rho, axis=-1) - 1.
+    lags = np.arange(rho.shape[-1])
+    in_window = lags[np.newaxis, :] >= window * cumulative_taus
+    cutoffs = np.where(np.any(in_window, axis=-1), np.argmax(in_window, axis=-1), rho.shape[-1] - 1)
+    taus = cumulative_taus[np.arange(len(rho)), cutoffs]
     return taus
@@ -80,10 +80,6 @@ def do_inference(given_key):
     ----------
     given_key: string
         name of test case to be run
-
-    Notes
-    -----
-    TODO: enable continuation of sampling starting from samples in a file
     """
     test_info = all_tests[given_key]
     test_name = test_info['name']
@@ -145,7 +141,7 @@ def do_inference(given_key):
     initial_values = start.sample(n_ivals)
 
     start_samps = timeit.default_timer()
-    nz_samps = nz.calculate_samples(initial_values, no_data=params['no_data'], no_prior=params['no_prior'], n_procs=1, gr_threshold=params['gr_threshold'])
+    nz_samps = nz.calculate_samples(initial_values, no_data=params['no_data'], no_prior=params['no_prior'], n_procs=1, gr_threshold=params['gr_threshold'], checkpoint='checkpoint.p')
     time_samps = timeit.default_timer()-start_samps
     print(test_name+' sampled '+str(params['n_accepted'])+' after '+str(nz.burn_ins * params['n_burned'])+' in '+str(time_samps))
 